@@ -0,0 +1,405 @@
+import argparse
+import concurrent.futures
+import json
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import yaml
+from os import listdir, path
+from typing import Callable, List
+from wikicodename.cache import Cache
+from wikicodename.config import Config
+from wikicodename.fetch_scheduler import FetchScheduler
+from wikicodename.generator import Generator
+from wikicodename.registry import Registry
+from wikicodename.sampling import AliasTable
+from wikicodename.wiki_data import WikiData, _parse_section
+from .fixtures import get_leaf_pages, get_wiki_host, record, synthesize
+from .replay_server import ReplayServer
+
+DEFAULT_FIXTURE_PATH = path.join(path.dirname(__file__), 'fixtures')
+DEFAULT_REPEAT_COUNT = 5
+DEFAULT_THRESHOLD = 1.25
+GENERATE_BATCH_SIZES = [10, 1000, 10000]
+REGISTER_COUNT = 1000
+FORMAT_PROFILE_NAMES = ['color-city', 'women-scientist-transformed', 'city']
+SAMPLE_COUNT = 100000
+FAULT_RATE = 0.05
+FAULT_STALL_TIME = 0.5
+FAULT_TIMEOUT = 0.25
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark the hot paths of wikicodename offline.')
+    arg_parser.add_argument(
+        '--fixture-path',
+        type=str,
+        default=DEFAULT_FIXTURE_PATH,
+        help='set a path to the directory with recorded responses')
+    arg_parser.add_argument(
+        '--record',
+        action='store_true',
+        help='record the responses for the default profiles from Wikipedia '
+        'and exit')
+    arg_parser.add_argument(
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT_COUNT,
+        help='set a number of measurements of each benchmark')
+    arg_parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help='write the results to the file instead of the standard output')
+    arg_parser.add_argument(
+        '--compare',
+        type=str,
+        default=None,
+        help='compare the results with a previous results file and fail on '
+        'regressions')
+    arg_parser.add_argument(
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help='set a maximum allowed ratio of the median time to the median '
+        'time in the compared results')
+    return arg_parser.parse_args()
+
+
+def measure(
+        name: str,
+        repeat_count: int,
+        function: Callable[[], int],
+        setup: Callable[[], None] = None) -> dict:
+    times = []
+    operation_count = 0
+    for _ in range(repeat_count):
+        if setup:
+            setup()
+        start_time = time.perf_counter()
+        operation_count = function()
+        times.append(time.perf_counter() - start_time)
+    return {
+        'name': name,
+        'repeat': repeat_count,
+        'operations': operation_count,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times)
+    }
+
+
+def get_default_config(base_path: str) -> Config:
+    config = Config(base_path)
+    config.generate()
+    config.load()
+    return config
+
+
+def redirect_config(base_path: str, urls: dict):
+    # Points every Wikipedia URL of the configuration to the replay servers.
+    for file_name in listdir(base_path):
+        file_path = path.join(base_path, file_name)
+        with open(file_path, 'r', encoding='utf8') as file:
+            data = yaml.load(file, Loader=yaml.SafeLoader)
+        if 'wikipedia_url' in data:
+            data['wikipedia_url'] = urls[get_wiki_host(data['wikipedia_url'])]
+        with open(file_path, 'w', encoding='utf8') as file:
+            yaml.dump(data, file, allow_unicode=True)
+
+
+def get_page_data(wiki_data: WikiData) -> list:
+    tables = []
+    for i in range(wiki_data.get_table_count()):
+        headers = wiki_data.get_table_headers(i)
+        tables.append([headers] + [
+            wiki_data.get_table_values_by_column(i, j)
+            for j in range(len(headers))])
+    lists = [
+        wiki_data.get_list_values(i)
+        for i in range(wiki_data.get_list_count())]
+    return [tables, lists]
+
+
+def run_benchmarks(
+        fixture_path: str, repeat_count: int, work_path: str) -> List[dict]:
+    results = []
+    config_path = path.join(work_path, 'config')
+    original_config = get_default_config(config_path)
+    leaf_pages = get_leaf_pages(original_config)
+    hosts = sorted(set(get_wiki_host(x[0]) for x in leaf_pages) |
+                   {get_wiki_host(original_config.get_wikipedia_url())})
+    servers = {x: ReplayServer(fixture_path, x) for x in hosts}
+    for server in servers.values():
+        server.start()
+    parse_executor = concurrent.futures.ProcessPoolExecutor()
+    try:
+        redirect_config(
+            config_path, {x: servers[x].get_url() for x in hosts})
+
+        def load_config():
+            Config(config_path).load()
+            return 1
+
+        results.append(measure('config_load', repeat_count, load_config))
+
+        config = Config(config_path)
+        config.load()
+        leaf_pages = get_leaf_pages(config)
+        servers_by_url = {x.get_url(): x for x in servers.values()}
+        cache_paths = []
+
+        def setup_cache():
+            cache_paths.append(tempfile.mkdtemp(dir=work_path))
+
+        # The pages of the last run are kept, so the faulty fetch can be
+        # checked against the clean one.
+        clean_pages = []
+        faulty_pages = []
+
+        def fetch():
+            cache = Cache(cache_paths[-1])
+            cache.setup()
+            section_count = 0
+            clean_pages.clear()
+            for wikipedia_url, page_id, _, excluded_sections in leaf_pages:
+                wiki_data = WikiData(
+                    cache, wikipedia_url, parse_executor=parse_executor)
+                wiki_data.fetch(page_id, excluded_sections)
+                clean_pages.append(wiki_data)
+                section_count += wiki_data.get_table_count() + \
+                    wiki_data.get_list_count()
+            return section_count
+
+        results.append(measure('wiki_data_fetch', repeat_count, fetch,
+                               setup_cache))
+
+        # The same pages are fetched from servers that throttle, fail or
+        # stall a part of the requests, which must be retried.
+        faulty_servers = {
+            x.get_url(): ReplayServer(
+                fixture_path,
+                host,
+                FAULT_RATE,
+                FAULT_STALL_TIME)
+            for host, x in servers.items()}
+
+        def fetch_faulty():
+            cache = Cache(cache_paths[-1])
+            cache.setup()
+            scheduler = FetchScheduler(
+                base_delay=0.01, max_delay=0.1, timeout=FAULT_TIMEOUT)
+            section_count = 0
+            faulty_pages.clear()
+            for wikipedia_url, page_id, _, excluded_sections in leaf_pages:
+                wiki_data = WikiData(
+                    cache,
+                    faulty_servers[wikipedia_url].get_url(),
+                    parse_executor=parse_executor,
+                    scheduler=scheduler)
+                wiki_data.fetch(page_id, excluded_sections)
+                faulty_pages.append(wiki_data)
+                section_count += wiki_data.get_table_count() + \
+                    wiki_data.get_list_count()
+            return section_count
+
+        for server in faulty_servers.values():
+            server.start()
+        try:
+            results.append(measure(
+                'wiki_data_fetch_faulty', repeat_count, fetch_faulty,
+                setup_cache))
+        finally:
+            for server in faulty_servers.values():
+                server.stop()
+        if [get_page_data(x) for x in faulty_pages] != \
+                [get_page_data(x) for x in clean_pages]:
+            raise RuntimeError(
+                'The faulty fetch returned different tables or lists than '
+                'the clean fetch.')
+
+        warm_cache = Cache(cache_paths[-1])
+        sections = []
+        for wikipedia_url, page_id, _, _ in leaf_pages:
+            server = servers_by_url[wikipedia_url]
+            section_id = 0
+            while True:
+                data = server.read_fixture(page_id, str(section_id))
+                if data is None:
+                    break
+                sections.append(json.loads(data)['parse']['text']['*'])
+                section_id += 1
+
+        def parse_sections():
+            for data in sections:
+                _parse_section(data)
+            return len(sections)
+
+        results.append(measure(
+            'wiki_data_parse_section', repeat_count, parse_sections))
+
+        fetched_pages = []
+        for wikipedia_url, page_id, sources, excluded_sections in leaf_pages:
+            wiki_data = WikiData(
+                warm_cache, wikipedia_url, parse_executor=parse_executor)
+            wiki_data.fetch(page_id, excluded_sections)
+            fetched_pages.append((wiki_data, sources))
+
+        def extract():
+            value_count = 0
+            for wiki_data, sources in fetched_pages:
+                for i in range(wiki_data.get_table_count()):
+                    value_count += len(wiki_data.get_table_values_by_headers(
+                        i, sources['tables']))
+                for i in range(wiki_data.get_list_count()):
+                    if sources['lists']:
+                        value_count += len(wiki_data.get_list_values(i))
+            return value_count
+
+        results.append(measure('wiki_data_extract', repeat_count, extract))
+
+        def iter_values():
+            value_count = 0
+            for wikipedia_url, page_id, sources, excluded_sections in \
+                    leaf_pages:
+                wiki_data = WikiData(
+                    warm_cache, wikipedia_url, parse_executor=parse_executor)
+                for _ in wiki_data.iter_values(
+                        page_id,
+                        sources['tables'],
+                        sources['lists'],
+                        excluded_sections):
+                    value_count += 1
+            return value_count
+
+        results.append(measure(
+            'wiki_data_iter_values', repeat_count, iter_values))
+
+        generator = Generator(config, warm_cache, quiet=True, seed=0)
+        values = [x.strip() for x in generator.generate_all('city')] + \
+            [x.strip() for x in generator.generate_all('women-scientist')]
+        profiles = [config.get_profile(x) for x in FORMAT_PROFILE_NAMES]
+
+        def format_code_names():
+            for profile in profiles:
+                for value in values:
+                    generator._Generator__format_code_name(value, profile)
+            return len(profiles) * len(values)
+
+        results.append(measure(
+            'generator_format_code_name', repeat_count, format_code_names))
+
+        alias_table = AliasTable([len(x) for x in values])
+        sample_random = random.Random(0)
+
+        def sample():
+            for _ in range(SAMPLE_COUNT):
+                alias_table.sample(sample_random)
+            return SAMPLE_COUNT
+
+        results.append(measure('sampling_alias_table', repeat_count, sample))
+
+        for batch_size in GENERATE_BATCH_SIZES:
+            def generate():
+                Generator(config, warm_cache, quiet=True, seed=0).generate(
+                    'main', batch_size)
+                return batch_size
+
+            results.append(measure(
+                'generator_generate_{}'.format(batch_size),
+                repeat_count,
+                generate))
+
+        # Every code name claimed in the registry must also be issued, even
+        # when the generation stops in the middle of a batch.
+        registry_paths = []
+
+        def setup_registry():
+            registry_paths.append(tempfile.mkdtemp(dir=work_path))
+
+        def generate_registered():
+            registry = Registry(registry_paths[-1])
+            registry.setup()
+            try:
+                code_names = Generator(
+                    config, warm_cache, quiet=True, seed=0,
+                    registry=registry).generate('main', REGISTER_COUNT)
+                registered_count = registry.get_count('main')
+            finally:
+                registry.close()
+            if registered_count != len(code_names):
+                raise RuntimeError(
+                    '{} code names were registered, but {} were '
+                    'generated.'.format(registered_count, len(code_names)))
+            return len(code_names)
+
+        results.append(measure(
+            'generator_generate_registered', repeat_count,
+            generate_registered, setup_registry))
+    finally:
+        parse_executor.shutdown()
+        for server in servers.values():
+            server.stop()
+    return results
+
+
+def compare_results(
+        results: List[dict], baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    baseline_results = {x['name']: x for x in baseline['benchmarks']}
+    for result in results:
+        baseline_result = baseline_results.get(result['name'])
+        if not baseline_result or baseline_result['median'] <= 0:
+            continue
+        ratio = result['median'] / baseline_result['median']
+        result['baseline_ratio'] = ratio
+        if ratio > threshold:
+            regressions.append('{}: {:.2f}x the baseline median time'.format(
+                result['name'], ratio))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as work_path:
+        if args.record:
+            record(get_default_config(path.join(work_path, 'config')),
+                   args.fixture_path)
+            return 0
+        fixture_path = args.fixture_path
+        fixture_source = 'recorded'
+        if not path.isdir(fixture_path) or not listdir(fixture_path):
+            fixture_path = path.join(work_path, 'fixtures')
+            fixture_source = 'synthetic'
+            synthesize(
+                get_default_config(path.join(work_path, 'default_config')),
+                fixture_path)
+        results = run_benchmarks(fixture_path, args.repeat, work_path)
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'fixture_source': fixture_source,
+        'benchmarks': results
+    }
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf8') as file:
+            regressions = compare_results(
+                results, json.load(file), args.threshold)
+    data = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf8') as file:
+            file.write(data + '\n')
+    else:
+        print(data)
+    for regression in regressions:
+        print(regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
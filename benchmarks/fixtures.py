@@ -0,0 +1,136 @@
+import json
+import random
+from os import makedirs, path
+from typing import Dict, List, Tuple
+from urllib.parse import urlencode, urljoin, urlparse
+from urllib.request import urlopen
+from wikicodename.config import Config
+from .replay_server import get_fixture_name
+
+SYNTHETIC_SECTION_COUNT = 8
+SYNTHETIC_TABLE_ROW_COUNT = 150
+SYNTHETIC_LIST_ITEM_COUNT = 150
+
+
+def get_wiki_host(wikipedia_url: str) -> str:
+    return urlparse(wikipedia_url).netloc
+
+
+def get_leaf_pages(config: Config) -> List[Tuple[str, str, dict, list]]:
+    leaf_pages = []
+    for profile_name in sorted(config.get_profile_name_list()):
+        profile = config.get_profile(profile_name)
+        if 'code_name_list' not in profile:
+            continue
+        code_name_list = profile['code_name_list']
+        wikipedia_url = code_name_list['wikipedia_url'] or \
+            config.get_wikipedia_url()
+        excluded_sections = code_name_list['excluded_sections'] or \
+            config.get_excluded_sections()
+        for page_id in code_name_list['pages']:
+            leaf_pages.append((
+                wikipedia_url,
+                page_id,
+                code_name_list['sources'],
+                excluded_sections))
+    return leaf_pages
+
+
+def _write_fixture(
+        fixture_path: str,
+        wiki_host: str,
+        page_id: str,
+        section_id,
+        data: str):
+    file_path = path.join(
+        fixture_path, get_fixture_name(wiki_host, page_id, section_id))
+    with open(file_path, 'w', encoding='utf8') as file:
+        file.write(data)
+
+
+def record(config: Config, fixture_path: str):
+    makedirs(fixture_path, exist_ok=True)
+    for wikipedia_url, page_id, _, _ in get_leaf_pages(config):
+        wiki_host = get_wiki_host(wikipedia_url)
+        url_base = urljoin(wikipedia_url, '/w/api.php')
+        url_params = {
+            'action': 'parse',
+            'page': page_id,
+            'format': 'json',
+            'prop': 'sections'
+        }
+        data = urlopen(url_base + '?' + urlencode(url_params)).read()
+        _write_fixture(
+            fixture_path, wiki_host, page_id, None, data.decode('utf-8'))
+        section_ids = [0] + [
+            int(x['index']) for x in json.loads(data)['parse']['sections']
+            if x['index']]
+        for section_id in section_ids:
+            url_params = {
+                'action': 'parse',
+                'page': page_id,
+                'format': 'json',
+                'section': section_id,
+                'prop': 'text',
+                'disabletoc': '1',
+                'disableeditsection': '1'
+            }
+            data = urlopen(url_base + '?' + urlencode(url_params)).read()
+            _write_fixture(
+                fixture_path,
+                wiki_host,
+                page_id,
+                str(section_id),
+                data.decode('utf-8'))
+
+
+def _get_word(rng: random.Random) -> str:
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'dra', 'gon']
+    return ''.join(
+        rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def _get_section_html(
+        rng: random.Random, sources: dict, title: str) -> str:
+    html = '<div class="mw-parser-output"><h2>{}</h2>'.format(title)
+    if sources['tables']:
+        headers = [sources['tables'][0], 'Country', 'Population']
+        html += '<table class="wikitable sortable"><tbody><tr>'
+        html += ''.join('<th>{}\n</th>'.format(x) for x in headers)
+        html += '</tr>'
+        for _ in range(SYNTHETIC_TABLE_ROW_COUNT):
+            html += '<tr><td><a href="/wiki/{0}" title="{0}">{0}</a></td>' \
+                '<td><span class="flagicon"></span><a href="/wiki/{1}">{1}' \
+                '</a></td><td>{2}</td></tr>'.format(
+                    _get_word(rng), _get_word(rng), rng.randint(1, 10**7))
+        html += '</tbody></table>'
+    if sources['lists']:
+        html += '<ul>'
+        for _ in range(SYNTHETIC_LIST_ITEM_COUNT):
+            html += '<li><a href="/wiki/{0}" title="{0}">{0}</a> ({1})' \
+                '</li>'.format(_get_word(rng), rng.randint(1800, 2000))
+        html += '</ul>'
+    return html + '</div>'
+
+
+def synthesize(config: Config, fixture_path: str):
+    # Generates fixtures with the same structure as the recorded ones, so the
+    # benchmarks can be run without access to Wikipedia.
+    makedirs(fixture_path, exist_ok=True)
+    for wikipedia_url, page_id, sources, _ in get_leaf_pages(config):
+        wiki_host = get_wiki_host(wikipedia_url)
+        rng = random.Random(page_id)
+        titles = ['Section {}'.format(x + 1)
+                  for x in range(SYNTHETIC_SECTION_COUNT)]
+        sections: List[Dict[str, str]] = [
+            {'toclevel': 1, 'level': '2', 'line': title,
+             'number': str(i + 1), 'index': str(i + 1)}
+            for i, title in enumerate(titles)]
+        _write_fixture(
+            fixture_path, wiki_host, page_id, None, json.dumps(
+                {'parse': {'title': page_id, 'sections': sections}}))
+        for section_id, title in enumerate([''] + titles):
+            html = _get_section_html(rng, sources, title)
+            _write_fixture(
+                fixture_path, wiki_host, page_id, str(section_id), json.dumps(
+                    {'parse': {'title': page_id, 'text': {'*': html}}}))
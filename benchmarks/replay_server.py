@@ -0,0 +1,137 @@
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+
+def get_fixture_name(
+        wiki_host: str, page_id: str, section_id: Optional[str]) -> str:
+    hash = hashlib.sha1()
+    hash.update('{}|{}|{}'.format(
+        wiki_host, page_id, section_id if section_id is not None else '')
+        .encode('utf-8'))
+    return hash.hexdigest() + '.json'
+
+
+class ReplayServer:
+
+    class __Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = parse_qs(url.query)
+            page_id = params.get('page', [None])[0]
+            section_id = params.get('section', [None])[0]
+            if url.path != '/w/api.php' or not page_id:
+                self.send_error(404)
+                return
+            fault = self.server.replay_server.get_fault()
+            if fault == 'throttle':
+                self.send_response(429)
+                self.send_header('Retry-After', '0')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if fault == 'unavailable':
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if fault == 'stall':
+                time.sleep(self.server.replay_server.get_stall_time())
+            data = self.server.replay_server.read_fixture(page_id, section_id)
+            if data is None:
+                data = json.dumps({'error': {
+                    'code': 'missingtitle',
+                    'info': 'The page you specified does not exist.'}})
+            body = data.encode('utf-8')
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            max_age = params.get('maxage', ['0'])[0]
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Cache-Control', 'max-age=' + max_age)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'max-age=' + max_age)
+            if 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+                body = gzip.compress(body)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client has given up on a stalled response.
+                pass
+
+        def log_message(self, format, *args):
+            pass
+
+    FAULTS = ['throttle', 'unavailable', 'stall']
+
+    def __init__(
+            self,
+            fixture_path: str,
+            wiki_host: str,
+            fault_rate: float = 0.0,
+            stall_time: float = 1.0,
+            seed: int = 0):
+        self.__fixture_path = fixture_path
+        self.__wiki_host = wiki_host
+        self.__fault_rate = fault_rate
+        self.__stall_time = stall_time
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__server = ThreadingHTTPServer(('127.0.0.1', 0), self.__Handler)
+        self.__server.daemon_threads = True
+        self.__server.replay_server = self
+        self.__thread = None
+
+    def get_fault(self) -> Optional[str]:
+        with self.__lock:
+            if self.__random.random() >= self.__fault_rate:
+                return None
+            return self.__random.choice(self.FAULTS)
+
+    def get_stall_time(self) -> float:
+        return self.__stall_time
+
+    def read_fixture(
+            self, page_id: str, section_id: Optional[str]) -> Optional[str]:
+        file_path = path.join(
+            self.__fixture_path,
+            get_fixture_name(self.__wiki_host, page_id, section_id))
+        if not path.isfile(file_path):
+            return None
+        with open(file_path, 'r', encoding='utf8') as file:
+            return file.read()
+
+    def get_url(self) -> str:
+        return 'http://127.0.0.1:{}/'.format(self.__server.server_address[1])
+
+    def start(self):
+        self.__thread = threading.Thread(
+            target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -1,25 +1,45 @@
 import argparse
+import json
+import os
 import sys
-from appdirs import user_cache_dir, user_config_dir
+import time
+from appdirs import user_cache_dir, user_config_dir, user_data_dir
 from colorama import Fore, init as colorama_init
 from os import path
 from .cache import Cache
 from .generator import Generator
 from .config import Config
+from .registry import Registry
+from .stats import Stats
 
 CONFIG_PATH_FLAG = '--config-path'
 CACHE_PATH_FLAG = '--cache-path'
+REGISTRY_PATH_FLAG = '--registry-path'
 PROFILE_FLAG = '--profile'
 PROFILE_FLAG_SHORT = '-p'
 COUNT_FLAG = '--count'
 COUNT_FLAG_SHORT = '-c'
 ATTEMPT_COUNT_FLAG = '--attempt-count'
+SEED_FLAG = '--seed'
+WORKER_COUNT_FLAG = '--worker-count'
+WORKER_COUNT_FLAG_SHORT = '-w'
+MATERIALIZE_THRESHOLD_FLAG = '--materialize-threshold'
+REGISTER_FLAG = '--register'
+REGISTER_FLAG_SHORT = '-r'
+STREAM_FLAG = '--stream'
 SORT_FLAG = '--sort'
 SORT_FLAG_SHORT = '-s'
 LIST_ALL_FLAG = '--list-all'
 LIST_PROFILES_FLAG = '--list-profiles'
+ESTIMATE_FLAG = '--estimate'
+PREFETCH_FLAG = '--prefetch'
+REFRESH_FLAG = '--refresh'
+EXPORT_BUNDLE_FLAG = '--export-bundle'
+IMPORT_BUNDLE_FLAG = '--import-bundle'
 GENERATE_CONFIG_FLAG = '--generate-config'
 CLEAR_CACHE_FLAG = '--clear-cache'
+CLEAR_REGISTRY_FLAG = '--clear-registry'
+STATS_FLAG = '--stats'
 QUIET_FLAG = '--quiet'
 QUIET_FLAG_SHORT = '-q'
 
@@ -27,18 +47,49 @@ APPLICATION_MESSAGE = 'Generate code names using lists and tables from ' \
     'Wikipedia articles.'
 CONFIG_PATH_FLAG_MESSAGE = 'set a path to the configuration directory'
 CACHE_PATH_FLAG_MESSAGE = 'set a path to the cache directory'
+REGISTRY_PATH_FLAG_MESSAGE = 'set a path to the registry directory'
 PROFILE_FLAG_MESSAGE = 'set a profile name'
-COUNT_FLAG_MESSAGE = 'set a length of the generated list of code names'
+COUNT_FLAG_MESSAGE = 'set a length of the generated list of code names (0 ' \
+    'generates code names until no new one can be found, only with the {} ' \
+    'flag)'.format(STREAM_FLAG)
 ATTEMPT_COUNT_FLAG_MESSAGE = 'set a maximum number of attempts to generate ' \
     'a valid code name'
+SEED_FLAG_MESSAGE = 'set a seed of the random number generator (the same seed ' \
+    'and number of workers always generate the same list of code names)'
+WORKER_COUNT_FLAG_MESSAGE = 'set a number of processes generating the list ' \
+    'of code names'
+MATERIALIZE_THRESHOLD_FLAG_MESSAGE = 'precompute and cache all valid code ' \
+    'names of a profile made of other profiles if it has at most this number ' \
+    'of combinations (0 disables it)'
+REGISTER_FLAG_MESSAGE = 'register the generated code names and never generate ' \
+    'the registered ones again'
+STREAM_FLAG_MESSAGE = 'print each code name as soon as it is generated'
 SORT_FLAG_MESSAGE = 'sort the generated list of code names'
 LIST_ALL_FLAG_MESSAGE = 'list all code names for the profile (must be a list ' \
-    'of code names)'
+    'of code names or have at most {} combinations)'.format(
+        MATERIALIZE_THRESHOLD_FLAG)
 LIST_PROFILES_FLAG_MESSAGE = 'list all available profiles'
+ESTIMATE_FLAG_MESSAGE = 'print a JSON estimate of the acceptance rate, the ' \
+    'number of distinct code names and the cost of a code name for the ' \
+    'profile and exit'
+PREFETCH_FLAG_MESSAGE = 'fetch data for the profiles (all profiles by ' \
+    'default) concurrently and exit'
+REFRESH_FLAG_MESSAGE = 'fetch data for the profiles (all profiles by ' \
+    'default) again, downloading only the pages that have changed, and exit'
+EXPORT_BUNDLE_FLAG_MESSAGE = 'fetch data for all profiles, save it to the ' \
+    'bundle file and exit'
+IMPORT_BUNDLE_FLAG_MESSAGE = 'load data for the profiles from the bundle ' \
+    'file and exit'
 GENERATE_CONFIG_FLAG_MESSAGE = 'generate a default configuration'
 CLEAR_CACHE_FLAG_MESSAGE = 'clear the cache'
+CLEAR_REGISTRY_FLAG_MESSAGE = 'remove the registered code names of the ' \
+    'profiles (all profiles by default) from the registry and exit'
+STATS_FLAG_MESSAGE = 'print a JSON report of timings and counters to the ' \
+    'standard error'
 QUIET_FLAG_MESSAGE = 'do not print additional messages (useful in scripts)'
 
+STREAM_FLUSH_INTERVAL = 0.1
+
 APP_DIRECTORY_NAME = 'wikicodename'
 CONFIG_VERSION_CACHE_KEY = 'config_version'
 
@@ -54,6 +105,12 @@ CONFIG_CHANGED_MESSAGE = '{}The configuration has changed. Please run the ' \
         Fore.YELLOW, CLEAR_CACHE_FLAG, Fore.RESET)
 CACHE_CLEARED_MESSAGE = '{}The cache has been cleared.{}'.format(
     Fore.GREEN, Fore.RESET)
+REGISTRY_CLEARED_MESSAGE = '{}The registry has been cleared.{}'.format(
+    Fore.GREEN, Fore.RESET)
+BUNDLE_EXPORTED_MESSAGE = '{}The bundle has been exported.{}'.format(
+    Fore.GREEN, Fore.RESET)
+BUNDLE_IMPORTED_MESSAGE = '{}The bundle has been imported.{}'.format(
+    Fore.GREEN, Fore.RESET)
 
 
 def get_default_config_path():
@@ -64,6 +121,10 @@ def get_default_cache_path():
     return user_cache_dir(APP_DIRECTORY_NAME, False)
 
 
+def get_default_registry_path():
+    return user_data_dir(APP_DIRECTORY_NAME, False)
+
+
 def parse_args():
     arg_parser = argparse.ArgumentParser(
         description=APPLICATION_MESSAGE, add_help=False)
@@ -81,6 +142,12 @@ def parse_args():
         nargs=1,
         default=get_default_cache_path(),
         help=CACHE_PATH_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        REGISTRY_PATH_FLAG,
+        type=str,
+        nargs=1,
+        default=get_default_registry_path(),
+        help=REGISTRY_PATH_FLAG_MESSAGE)
     arg_parser.add_argument(
         PROFILE_FLAG,
         PROFILE_FLAG_SHORT,
@@ -101,6 +168,38 @@ def parse_args():
         nargs=1,
         default=64,
         help=ATTEMPT_COUNT_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        SEED_FLAG,
+        type=int,
+        nargs=1,
+        default=None,
+        help=SEED_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        WORKER_COUNT_FLAG,
+        WORKER_COUNT_FLAG_SHORT,
+        type=int,
+        nargs=1,
+        default=1,
+        help=WORKER_COUNT_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        MATERIALIZE_THRESHOLD_FLAG,
+        type=int,
+        nargs=1,
+        default=0,
+        help=MATERIALIZE_THRESHOLD_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        REGISTER_FLAG,
+        REGISTER_FLAG_SHORT,
+        action='store_const',
+        const=True,
+        default=False,
+        help=REGISTER_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        STREAM_FLAG,
+        action='store_const',
+        const=True,
+        default=False,
+        help=STREAM_FLAG_MESSAGE)
     arg_parser.add_argument(
         SORT_FLAG,
         SORT_FLAG_SHORT,
@@ -120,6 +219,40 @@ def parse_args():
         const=True,
         default=False,
         help=LIST_PROFILES_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        ESTIMATE_FLAG,
+        action='store_const',
+        const=True,
+        default=False,
+        help=ESTIMATE_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        PREFETCH_FLAG,
+        type=str,
+        nargs='*',
+        default=None,
+        metavar='PROFILE',
+        help=PREFETCH_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        REFRESH_FLAG,
+        type=str,
+        nargs='*',
+        default=None,
+        metavar='PROFILE',
+        help=REFRESH_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        EXPORT_BUNDLE_FLAG,
+        type=str,
+        nargs=1,
+        default=None,
+        metavar='FILE',
+        help=EXPORT_BUNDLE_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        IMPORT_BUNDLE_FLAG,
+        type=str,
+        nargs=1,
+        default=None,
+        metavar='FILE',
+        help=IMPORT_BUNDLE_FLAG_MESSAGE)
     arg_parser.add_argument(
         GENERATE_CONFIG_FLAG,
         action='store_const',
@@ -132,6 +265,19 @@ def parse_args():
         const=True,
         default=False,
         help=CLEAR_CACHE_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        CLEAR_REGISTRY_FLAG,
+        type=str,
+        nargs='*',
+        default=None,
+        metavar='PROFILE',
+        help=CLEAR_REGISTRY_FLAG_MESSAGE)
+    arg_parser.add_argument(
+        STATS_FLAG,
+        action='store_const',
+        const=True,
+        default=False,
+        help=STATS_FLAG_MESSAGE)
     arg_parser.add_argument(
         QUIET_FLAG,
         QUIET_FLAG_SHORT,
@@ -139,7 +285,17 @@ def parse_args():
         const=True,
         default=False,
         help=QUIET_FLAG_MESSAGE)
-    return arg_parser.parse_args()
+    args = arg_parser.parse_args()
+    if args.stream and args.sort:
+        arg_parser.error('the {} and {} flags are mutually exclusive'.format(
+            STREAM_FLAG, SORT_FLAG))
+    if args.register and args.list_all:
+        arg_parser.error('the {} and {} flags are mutually exclusive'.format(
+            REGISTER_FLAG, LIST_ALL_FLAG))
+    if get_arg(args.count) <= 0 and not args.stream:
+        arg_parser.error('the count must be positive without the {} '
+                         'flag'.format(STREAM_FLAG))
+    return args
 
 
 def get_arg(value):
@@ -155,9 +311,29 @@ def print_exception(exception: Exception):
             print(exception.source_exception, file=sys.stderr)
 
 
+def print_stream(code_names):
+    # The output is flushed periodically instead of on every line, so the
+    # first code names appear immediately also when it is piped, without
+    # a system call per code name.
+    last_flush_time = None
+    for code_name in code_names:
+        print(code_name)
+        current_time = time.monotonic()
+        if last_flush_time is None or \
+                current_time - last_flush_time >= STREAM_FLUSH_INTERVAL:
+            sys.stdout.flush()
+            last_flush_time = current_time
+    sys.stdout.flush()
+
+
+def print_stats(stats: Stats):
+    print(json.dumps(stats.get_report(), indent=4), file=sys.stderr)
+
+
 def main():
     colorama_init()
     args = parse_args()
+    stats = Stats()
     config_path = get_arg(args.config_path)
     if config_path == get_default_config_path():
         if not path.isdir(config_path):
@@ -187,7 +363,7 @@ def main():
         print_exception(e)
         return 2
     try:
-        cache = Cache(get_arg(args.cache_path))
+        cache = Cache(get_arg(args.cache_path), stats)
         cache.setup()
         if args.clear_cache:
             cache.clear()
@@ -202,12 +378,78 @@ def main():
     except Cache.CacheException as e:
         print_exception(e)
         return 3
+    registry = None
+    if args.register or args.clear_registry is not None:
+        try:
+            registry = Registry(get_arg(args.registry_path))
+            registry.setup()
+            if args.clear_registry is not None:
+                profile_names = [
+                    x for x in args.clear_registry if x != 'all']
+                if profile_names:
+                    for profile_name in profile_names:
+                        registry.clear(profile_name)
+                else:
+                    registry.clear()
+                registry.close()
+                if not args.quiet:
+                    print(REGISTRY_CLEARED_MESSAGE)
+                return 0
+        except Registry.RegistryException as e:
+            registry.close()
+            print_exception(e)
+            return 5
+    generator = None
     try:
         generator = Generator(
             config,
             cache,
             get_arg(args.attempt_count),
-            get_arg(args.quiet))
+            get_arg(args.quiet),
+            get_arg(args.seed),
+            get_arg(args.worker_count),
+            registry,
+            stats,
+            get_arg(args.materialize_threshold))
+        if args.prefetch is not None:
+            profile_names = [x for x in args.prefetch if x != 'all']
+            generator.prefetch(profile_names)
+            return 0
+        if args.refresh is not None:
+            profile_names = [x for x in args.refresh if x != 'all']
+            generator.prefetch(profile_names, True)
+            return 0
+        if args.export_bundle:
+            generator.export_bundle(get_arg(args.export_bundle))
+            if not args.quiet:
+                print(BUNDLE_EXPORTED_MESSAGE)
+            return 0
+        if args.import_bundle:
+            generator.import_bundle(get_arg(args.import_bundle))
+            if not args.quiet:
+                print(BUNDLE_IMPORTED_MESSAGE)
+            return 0
+        if args.estimate:
+            estimate = generator.get_estimate(get_arg(args.profile))
+            print(json.dumps(estimate, indent=4))
+            return 0
+        if args.stream:
+            if args.list_all:
+                code_names = generator.iter_generate_all(
+                    get_arg(args.profile))
+            else:
+                count = get_arg(args.count)
+                code_names = generator.iter_generate(
+                    get_arg(args.profile), count if count > 0 else None)
+            try:
+                print_stream(code_names)
+            except BrokenPipeError:
+                # The reading end is closed (e.g. piped into head), so the
+                # remaining output is discarded.
+                devnull = os.open(os.devnull, os.O_WRONLY)
+                os.dup2(devnull, sys.stdout.fileno())
+                return 0
+            return 0
         code_name_list = None
         if args.list_all:
             code_name_list = generator.generate_all(
@@ -222,6 +464,13 @@ def main():
     except Generator.GeneratorException as e:
         print_exception(e)
         return 4
+    finally:
+        if generator:
+            generator.flush_estimates()
+        if registry:
+            registry.close()
+        if args.stats:
+            print_stats(stats)
     return 0
 
 
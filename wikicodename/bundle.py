@@ -0,0 +1,87 @@
+import hashlib
+import json
+import zipfile
+from typing import Dict, List, Tuple
+
+
+class Bundle:
+
+    FORMAT_VERSION = 1
+    MANIFEST_FILE_NAME = 'manifest.json'
+
+    class BundleException(Exception):
+        def __init__(self, message: str, source_exception: Exception = None):
+            self.source_exception = source_exception
+            super().__init__(message)
+
+    def __init__(self, file_path: str):
+        self.__file_path = file_path
+
+    def __get_entry_name(self, profile_name: str) -> str:
+        return 'profiles/{}.json'.format(profile_name)
+
+    def write(
+            self,
+            config_version: str,
+            code_name_lists: Dict[str, Tuple[str, List[str]]]):
+        manifest = {
+            'format_version': self.FORMAT_VERSION,
+            'config_version': config_version,
+            'profiles': {}
+        }
+        try:
+            with zipfile.ZipFile(
+                    self.__file_path,
+                    'w',
+                    zipfile.ZIP_DEFLATED,
+                    compresslevel=9) as file:
+                for profile_name, (profile_version, code_name_list) in \
+                        sorted(code_name_lists.items()):
+                    data = json.dumps(
+                        code_name_list, ensure_ascii=False).encode('utf-8')
+                    entry_name = self.__get_entry_name(profile_name)
+                    file.writestr(entry_name, data)
+                    manifest['profiles'][profile_name] = {
+                        'profile_version': profile_version,
+                        'count': len(code_name_list),
+                        'sha256': hashlib.sha256(data).hexdigest()
+                    }
+                file.writestr(
+                    self.MANIFEST_FILE_NAME,
+                    json.dumps(manifest, indent=4, sort_keys=True))
+        except OSError as e:
+            raise Bundle.BundleException(
+                'Could not write the bundle: {}'.format(self.__file_path), e)
+
+    def read(self) -> Tuple[str, Dict[str, Tuple[str, List[str]]]]:
+        code_name_lists = {}
+        try:
+            with zipfile.ZipFile(self.__file_path, 'r') as file:
+                manifest = json.loads(file.read(self.MANIFEST_FILE_NAME))
+                if manifest.get('format_version') != self.FORMAT_VERSION:
+                    raise Bundle.BundleException(
+                        'The bundle format is not supported: {}'.format(
+                            manifest.get('format_version')))
+                for profile_name, entry in manifest['profiles'].items():
+                    data = file.read(self.__get_entry_name(profile_name))
+                    if hashlib.sha256(data).hexdigest() != entry['sha256']:
+                        raise Bundle.BundleException(
+                            'The checksum does not match for the profile: '
+                            '{}'.format(profile_name))
+                    code_name_list = json.loads(data)
+                    if not isinstance(code_name_list, list) or \
+                            len(code_name_list) != entry['count'] or \
+                            not all(isinstance(x, str) and x
+                                    for x in code_name_list):
+                        raise Bundle.BundleException(
+                            'The list of code names is invalid for the '
+                            'profile: {}'.format(profile_name))
+                    code_name_lists[profile_name] = (
+                        entry['profile_version'], code_name_list)
+                return manifest['config_version'], code_name_lists
+        except Bundle.BundleException:
+            raise
+        except (OSError, KeyError, TypeError, ValueError,
+                zipfile.BadZipFile) as e:
+            raise Bundle.BundleException(
+                'Could not read the bundle: {}'.format(self.__file_path), e)
@@ -1,23 +1,35 @@
 import hashlib
-from os import listdir, makedirs, path, remove
+import json
+import threading
+from os import getpid, listdir, makedirs, path, remove, replace
 from typing import Optional
+from .stats import Stats
 
 
 class Cache:
 
+    METADATA_FILE_EXTENSION = '.meta'
+    TEMPORARY_FILE_EXTENSION = '.tmp'
+
     class CacheException(Exception):
         def __init__(self, message: str, source_exception: Exception = None):
             self.source_exception = source_exception
             super().__init__(message)
 
-    def __init__(self, base_path: str = 'cache/'):
+    def __init__(self, base_path: str = 'cache/', stats: Stats = None):
         self.__base_path = base_path
+        self.__stats = stats
+        if not self.__stats:
+            self.__stats = Stats()
 
     def __get_file_path(self, id: str) -> str:
         hash = hashlib.sha1()
         hash.update(id.encode('utf-8'))
         return path.join(self.__base_path, hash.hexdigest())
 
+    def get_base_path(self) -> str:
+        return self.__base_path
+
     def setup(self) -> None:
         try:
             makedirs(self.__base_path, exist_ok=True)
@@ -31,21 +43,63 @@ class Cache:
         data = None
         file_path = self.__get_file_path(id)
         try:
-            file = open(file_path, 'r', encoding='utf8')
-            data = file.read()
-            file.close()
+            with self.__stats.measure('cache.read_time'):
+                file = open(file_path, 'r', encoding='utf8')
+                data = file.read()
+                file.close()
         except FileNotFoundError:
             pass
         except OSError as e:
             raise Cache.CacheException(
                 'Could not read from the file: {}'.format(file_path), e)
+        if data:
+            self.__stats.increment('cache.hit_count')
+            self.__stats.increment('cache.read_size', len(data))
+        else:
+            self.__stats.increment('cache.miss_count')
         return data
 
     def write(self, id: str, data: str):
         file_path = self.__get_file_path(id)
+        try:
+            # The file is replaced at once, so other processes sharing the
+            # cache never read a partially written file.
+            temporary_file_path = '{}.{}-{}{}'.format(
+                file_path,
+                getpid(),
+                threading.get_ident(),
+                self.TEMPORARY_FILE_EXTENSION)
+            with self.__stats.measure('cache.write_time'):
+                file = open(temporary_file_path, 'w', encoding='utf8')
+                file.write(data)
+                file.close()
+                replace(temporary_file_path, file_path)
+            self.__stats.increment('cache.write_count')
+            self.__stats.increment('cache.write_size', len(data))
+        except OSError as e:
+            raise Cache.CacheException(
+                'Could not write to the file: {}'.format(file_path), e)
+
+    def read_metadata(self, id: str) -> Optional[dict]:
+        file_path = self.__get_file_path(id) + self.METADATA_FILE_EXTENSION
+        try:
+            file = open(file_path, 'r', encoding='utf8')
+            data = json.load(file)
+            file.close()
+            return data
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            return None
+        except OSError as e:
+            raise Cache.CacheException(
+                'Could not read from the file: {}'.format(file_path), e)
+
+    def write_metadata(self, id: str, metadata: dict):
+        file_path = self.__get_file_path(id) + self.METADATA_FILE_EXTENSION
         try:
             file = open(file_path, 'w', encoding='utf8')
-            file.write(data)
+            json.dump(metadata, file)
             file.close()
         except OSError as e:
             raise Cache.CacheException(
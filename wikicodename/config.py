@@ -1,4 +1,6 @@
 import hashlib
+import json
+import math
 import yaml
 from distutils.dir_util import copy_tree
 from distutils.errors import DistutilsFileError, DistutilsInternalError
@@ -91,7 +93,7 @@ class Config:
     def __load_profile(self, name: str, data: dict) -> dict:
         if not name:
             raise self.__MissingParameterException('profile/name')
-        if '{' in name or '}' in name:
+        if any(x in name for x in '{}|:'):
             raise self.__InvalidParameterValueException('profile/name', name)
         if self.get_profile(name):
             raise self.ConfigException(
@@ -173,6 +175,7 @@ class Config:
             data, 'pages', types=list)
         code_name_list['sources'] = self.__load_parameter(
             data, 'sources', types=dict)
+        weights = self.__load_parameter(data, 'weights', True, dict)
         for value in code_name_list['pages']:
             if not isinstance(value, str):
                 raise self.__InvalidParameterTypeException(
@@ -181,6 +184,21 @@ class Config:
             code_name_list['wikipedia_url'] = False
         if not code_name_list['excluded_sections']:
             code_name_list['excluded_sections'] = False
+        if weights:
+            for key, value in weights.items():
+                if not isinstance(key, str):
+                    raise self.__InvalidParameterTypeException(
+                        'weights/key', type(key))
+                if isinstance(value, bool) or \
+                        not isinstance(value, (int, float)):
+                    raise self.__InvalidParameterTypeException(
+                        'weights/value', type(value))
+                if value < 0 or not math.isfinite(value):
+                    raise self.__InvalidParameterValueException(
+                        'weights/value', value)
+            # The key is only defined when needed, so the configuration
+            # version of the existing lists does not change.
+            code_name_list['weights'] = weights
         if 'lists' in code_name_list['sources']:
             if not isinstance(code_name_list['sources']['lists'], bool):
                 raise self.__InvalidParameterTypeException(
@@ -265,6 +283,25 @@ class Config:
         hash.update(str(self.__dict__).encode('utf-8'))
         return hash.hexdigest()
 
+    def get_profile_version(self, name: str) -> Optional[str]:
+        profile = self.get_profile(name)
+        if not profile:
+            return None
+        data = dict(profile)
+        if 'code_name_list' in profile:
+            # The defaults from the main file are resolved, so the version
+            # changes whenever the data of the list would change.
+            code_name_list = dict(profile['code_name_list'])
+            if not code_name_list['wikipedia_url']:
+                code_name_list['wikipedia_url'] = self.__wikipedia_url
+            if not code_name_list['excluded_sections']:
+                code_name_list['excluded_sections'] = \
+                    self.__excluded_sections
+            data['code_name_list'] = code_name_list
+        hash = hashlib.sha1()
+        hash.update(json.dumps(data, sort_keys=True).encode('utf-8'))
+        return hash.hexdigest()
+
     def get_wikipedia_url(self) -> Optional[str]:
         return self.__wikipedia_url
 
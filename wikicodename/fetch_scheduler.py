@@ -0,0 +1,235 @@
+import random
+import threading
+import time
+import zlib
+from email.message import Message
+from email.utils import parsedate_to_datetime
+from typing import Dict, NamedTuple, Optional
+from urllib.error import HTTPError
+from urllib.parse import urlparse
+from urllib.request import Request, urlopen
+from .stats import Stats
+
+
+class FetchScheduler:
+
+    RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+    THROTTLE_STATUS_CODES = [429, 503]
+    NOT_MODIFIED_STATUS_CODE = 304
+    READ_CHUNK_SIZE = 64 * 1024
+
+    class Response(NamedTuple):
+        status: int
+        headers: Message
+        data: bytes
+
+    class __HostState:
+
+        def __init__(self, rate: float, burst: float, concurrency: float):
+            self.condition = threading.Condition()
+            self.rate = rate
+            self.tokens = burst
+            self.refill_time = time.monotonic()
+            self.blocked_until = 0.0
+            self.concurrency = concurrency
+            self.active_count = 0
+            self.best_latency: Optional[float] = None
+
+    def __init__(
+            self,
+            rate: float = 100.0,
+            burst: float = 50.0,
+            min_rate: float = 1.0,
+            min_concurrency: int = 1,
+            max_concurrency: int = 8,
+            max_retry_count: int = 6,
+            base_delay: float = 0.5,
+            max_delay: float = 60.0,
+            timeout: float = 30.0,
+            stats: Stats = None):
+        self.__rate = rate
+        self.__burst = burst
+        self.__min_rate = min_rate
+        self.__min_concurrency = min_concurrency
+        self.__max_concurrency = max_concurrency
+        self.__max_retry_count = max_retry_count
+        self.__base_delay = base_delay
+        self.__max_delay = max_delay
+        self.__timeout = timeout
+        self.__stats = stats
+        self.__lock = threading.Lock()
+        self.__hosts: Dict[str, FetchScheduler.__HostState] = {}
+        self.__random = random.Random()
+        if not self.__stats:
+            self.__stats = Stats()
+
+    def __get_host_state(self, url: str) -> 'FetchScheduler.__HostState':
+        host = urlparse(url).netloc
+        with self.__lock:
+            if host not in self.__hosts:
+                self.__hosts[host] = FetchScheduler.__HostState(
+                    self.__rate, self.__burst, self.__max_concurrency)
+            return self.__hosts[host]
+
+    def __acquire(self, state: 'FetchScheduler.__HostState') -> None:
+        with state.condition:
+            while True:
+                current_time = time.monotonic()
+                state.tokens = min(
+                    self.__burst,
+                    state.tokens +
+                    (current_time - state.refill_time) * state.rate)
+                state.refill_time = current_time
+                wait_time = 0.0
+                if current_time < state.blocked_until:
+                    wait_time = state.blocked_until - current_time
+                elif state.tokens < 1:
+                    wait_time = (1 - state.tokens) / state.rate
+                elif state.active_count >= int(state.concurrency):
+                    wait_time = None
+                else:
+                    state.tokens -= 1
+                    state.active_count += 1
+                    return
+                state.condition.wait(wait_time)
+
+    def __release(
+            self,
+            state: 'FetchScheduler.__HostState',
+            latency: Optional[float]) -> None:
+        # The concurrency and the rate are adjusted with the additive increase
+        # and the multiplicative decrease. The concurrency grows while the
+        # latency stays close to the best observed one and shrinks on errors
+        # or slow responses.
+        with state.condition:
+            state.active_count -= 1
+            if latency is not None:
+                state.rate = min(
+                    self.__rate, state.rate + self.__rate / 100)
+            if latency is None:
+                state.concurrency = max(
+                    self.__min_concurrency, state.concurrency / 2)
+            else:
+                if state.best_latency is None or \
+                        latency < state.best_latency:
+                    state.best_latency = latency
+                if latency > 4 * state.best_latency:
+                    state.concurrency = max(
+                        self.__min_concurrency, state.concurrency * 0.75)
+                else:
+                    state.concurrency = min(
+                        self.__max_concurrency,
+                        state.concurrency + 1 / state.concurrency)
+            state.condition.notify_all()
+
+    def __throttle(
+            self, state: 'FetchScheduler.__HostState', delay: float) -> None:
+        with state.condition:
+            state.rate = max(self.__min_rate, state.rate / 2)
+            state.tokens = min(state.tokens, 0)
+            state.blocked_until = max(
+                state.blocked_until, time.monotonic() + delay)
+            state.condition.notify_all()
+
+    def __get_retry_after(self, error: HTTPError) -> Optional[float]:
+        value = error.headers.get('Retry-After') if error.headers else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() -
+                       time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def __get_backoff_delay(self, attempt_index: int) -> float:
+        # Full jitter keeps the retries of concurrent requests apart.
+        delay = min(self.__max_delay, self.__base_delay * 2 ** attempt_index)
+        return self.__random.uniform(0, delay)
+
+    def __read(self, response) -> bytes:
+        # The compressed response is decompressed while it is being read, so
+        # the compressed and the decompressed data are never held at once.
+        encoding = (response.headers.get('Content-Encoding') or '').lower()
+        if encoding not in ['gzip', 'x-gzip', 'deflate']:
+            data = response.read()
+            self.__stats.increment('wiki_data.transfer_bytes', len(data))
+            return data
+        if encoding == 'deflate':
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS)
+        else:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        chunks = []
+        first_chunk = True
+        while True:
+            chunk = response.read(self.READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.__stats.increment('wiki_data.transfer_bytes', len(chunk))
+            try:
+                chunks.append(decompressor.decompress(chunk))
+            except zlib.error:
+                # Some servers send a raw deflate stream without the zlib
+                # header.
+                if encoding != 'deflate' or not first_chunk:
+                    raise
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                chunks.append(decompressor.decompress(chunk))
+            first_chunk = False
+        chunks.append(decompressor.flush())
+        return b''.join(chunks)
+
+    def get_max_concurrency(self) -> int:
+        return self.__max_concurrency
+
+    def fetch(
+            self,
+            url: str,
+            headers: Dict[str, str] = None) -> 'FetchScheduler.Response':
+        state = self.__get_host_state(url)
+        request_headers = {'Accept-Encoding': 'gzip, deflate'}
+        if headers:
+            request_headers.update(headers)
+        attempt_index = 0
+        while True:
+            self.__acquire(state)
+            start_time = time.monotonic()
+            try:
+                # The latency is measured until the response headers arrive,
+                # so it does not depend on the size of the response.
+                with urlopen(
+                        Request(url, headers=request_headers),
+                        timeout=self.__timeout) as response:
+                    latency = time.monotonic() - start_time
+                    data = self.__read(response)
+                    status = response.status
+                    response_headers = response.headers
+            except HTTPError as e:
+                if e.code == self.NOT_MODIFIED_STATUS_CODE:
+                    self.__release(state, time.monotonic() - start_time)
+                    return FetchScheduler.Response(e.code, e.headers, b'')
+                self.__release(state, None)
+                if e.code not in self.RETRY_STATUS_CODES or \
+                        attempt_index >= self.__max_retry_count:
+                    raise
+                delay = self.__get_backoff_delay(attempt_index)
+                if e.code in self.THROTTLE_STATUS_CODES:
+                    self.__stats.increment('wiki_data.throttled_count')
+                    retry_after = self.__get_retry_after(e)
+                    if retry_after is not None:
+                        delay = max(delay, min(retry_after, self.__max_delay))
+                    self.__throttle(state, delay)
+            except (OSError, zlib.error):
+                self.__release(state, None)
+                if attempt_index >= self.__max_retry_count:
+                    raise
+                delay = self.__get_backoff_delay(attempt_index)
+            else:
+                self.__release(state, latency)
+                return FetchScheduler.Response(status, response_headers, data)
+            self.__stats.increment('wiki_data.retry_count')
+            time.sleep(delay)
+            attempt_index += 1
@@ -1,16 +1,38 @@
+import concurrent.futures
+import hashlib
+import itertools
 import json
+import math
 import random
 import re
+import threading
+import time
 from colorama import Fore
 from text_unidecode import unidecode
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from .bundle import Bundle
 from .cache import Cache
 from .config import Config
+from .fetch_scheduler import FetchScheduler
+from .page_store import PageStore
+from .registry import Registry
+from .sampling import AliasTable
+from .stats import Stats
 from .wiki_data import WikiData
 
 
 class Generator:
 
+    PARALLEL_CHUNK_SIZE = 4096
+    REGISTRY_BATCH_SIZE = 1024
+    ESTIMATE_CACHE_NAME = 'estimates'
+    VIEW_CACHE_NAME_PREFIX = 'view_'
+    ESTIMATE_MIN_DRAW_COUNT = 256
+    ESTIMATE_SAVE_DRAW_COUNT = 4096
+    ESTIMATE_SAVE_INTERVAL = 60
+    ATTEMPT_BUDGET_FACTOR = 16
+    MAX_FAILURE_PROBABILITY = 1e-9
+
     class GeneratorException(Exception):
 
         def __init__(
@@ -26,28 +48,153 @@ class Generator:
             else:
                 super().__init__(message)
 
+    class __Progress:
+
+        def __init__(self, page_counts: Dict[str, int], quiet: bool):
+            self.__page_counts = page_counts
+            self.__quiet = quiet
+            self.__lock = threading.Lock()
+            self.__started_page_count = 0
+            self.__finished_profile_count = 0
+            self.__line_length = 0
+
+        def __print(self, message: str, color: str, end: str = '') -> None:
+            padding = ' ' * max(0, self.__line_length - len(message))
+            print('\r{}{}{}{}'.format(color, message, padding, Fore.RESET),
+                  end=end, flush=True)
+            self.__line_length = 0 if end else len(message)
+
+        def start_page(self, profile_name: str, page_index: int) -> None:
+            if self.__quiet:
+                return
+            with self.__lock:
+                self.__started_page_count += 1
+                if len(self.__page_counts) == 1:
+                    message = 'Fetching data for the profile: {} ' \
+                        '(page {}/{})'.format(
+                            profile_name,
+                            page_index + 1,
+                            self.__page_counts[profile_name])
+                else:
+                    message = 'Fetching data for the profiles: {}/{} ' \
+                        '(page {}/{})'.format(
+                            self.__finished_profile_count,
+                            len(self.__page_counts),
+                            self.__started_page_count,
+                            sum(self.__page_counts.values()))
+                self.__print(message, Fore.YELLOW)
+
+        def finish_profile(self, profile_name: str) -> None:
+            with self.__lock:
+                self.__finished_profile_count += 1
+
+        def finish(self) -> None:
+            if self.__quiet:
+                return
+            with self.__lock:
+                if len(self.__page_counts) == 1:
+                    message = 'Fetched data for the profile: {}'.format(
+                        next(iter(self.__page_counts)))
+                else:
+                    message = 'Fetched data for the profiles: {}'.format(
+                        ', '.join(self.__page_counts))
+                self.__print(message, Fore.GREEN, '\n')
+
     def __init__(
             self,
             config: Config = None,
             cache: Cache = None,
             max_attempt_count: int = 64,
-            quiet: bool = False) -> None:
+            quiet: bool = False,
+            seed: Optional[Union[int, str]] = None,
+            worker_count: int = 1,
+            registry: Registry = None,
+            stats: Stats = None,
+            materialize_threshold: int = 0,
+            save_estimates: bool = True) -> None:
         self.__config = config
         self.__cache = cache
+        self.__registry = registry
+        self.__stats = stats
         self.__max_attempt_count = max_attempt_count
         self.__quiet = quiet
+        self.__seed = seed
+        self.__local = threading.local()
+        self.__random_lock = threading.Lock()
+        self.__random_count = 0
+        self.__build_lock = threading.RLock()
+        self.__worker_count = max(1, worker_count)
+        self.__materialize_threshold = materialize_threshold
+        self.__code_name_lists: Dict[str, Tuple[str, ...]] = {}
+        self.__patterns: Dict[str, Dict[str, Union[str, list]]] = {}
+        self.__prepared_profile_names: set[str] = set()
+        self.__estimate_lock = threading.Lock()
+        self.__estimates: Optional[Dict[str, Dict[str, Union[str, int]]]] = \
+            None
+        self.__estimate_deltas: Dict[str, List[int]] = {}
+        self.__save_estimates_enabled = save_estimates
+        self.__estimate_save_time = time.monotonic()
+        self.__distinct_counts: Dict[str, Tuple[Tuple[str, ...], int]] = {}
+        self.__attempt_budgets: Dict[str, int] = {}
+        self.__views: Dict[str, Optional[dict]] = {}
+        self.__list_hashes: Dict[str, Tuple[Tuple[str, ...], str]] = {}
+        self.__list_alias_tables: Dict[
+            str, Tuple[Tuple[str, ...], Optional[AliasTable]]] = {}
         if not self.__config:
             self.__config = Config()
+        if not self.__stats:
+            self.__stats = Stats()
+        self.__scheduler = FetchScheduler(stats=self.__stats)
         if not self.__cache:
-            self.__cache = Cache()
+            self.__cache = Cache(stats=self.__stats)
             self.__cache.setup()
 
-    def __parse_pattern(self, pattern: str) -> Dict[str, List[str]]:
+    def __get_random(self) -> random.Random:
+        # Each thread draws from its own generator. The first one is seeded
+        # with the seed itself and the next ones with seeds derived from it.
+        rng = getattr(self.__local, 'random', None)
+        if rng is None:
+            with self.__random_lock:
+                random_index = self.__random_count
+                self.__random_count += 1
+            if self.__seed is None:
+                rng = random.Random()
+            elif random_index == 0:
+                rng = random.Random(self.__seed)
+            else:
+                rng = random.Random('{}:thread:{}'.format(
+                    self.__seed, random_index))
+            self.__local.random = rng
+        return rng
+
+    def __parse_alternatives(
+            self, sequence: str) -> Dict[str, Union[List[str], List[float]]]:
+        profiles: list[str] = []
+        weights: list[float] = []
+        for alternative in sequence.split('|'):
+            profile = alternative
+            weight = 1.0
+            if ':' in alternative:
+                profile, weight_data = alternative.rsplit(':', 1)
+                try:
+                    weight = float(weight_data)
+                except ValueError:
+                    weight = -1.0
+                if not weight > 0 or not math.isfinite(weight):
+                    raise self.GeneratorException(
+                        'The weight of the alternative is invalid: '
+                        '{}'.format(alternative))
+            profiles.append(profile)
+            weights.append(weight)
+        return {'profiles': profiles, 'weights': weights}
+
+    def __parse_pattern(self, pattern: str) -> Dict[str, Union[str, list]]:
         start = 0
         end = 0
         sequence_start = -1
         format_pattern = ''
         profiles: list[str] = []
+        sequences: list[dict] = []
         while end >= 0 and end < len(pattern):
             if sequence_start < 0:
                 end = pattern.find('{', start)
@@ -59,13 +206,66 @@ class Generator:
                     sequence_start = end + 1
                 else:
                     format_pattern += '}'
-                    profile = pattern[sequence_start:end]
-                    profiles.append(profile)
+                    sequence = self.__parse_alternatives(
+                        pattern[sequence_start:end])
+                    profiles += sequence['profiles']
+                    sequences.append(sequence)
                     sequence_start = -1
                 start = end + 1
                 end = start
         format_pattern += pattern[start:]
-        return {'format_pattern': format_pattern, 'profiles': profiles}
+        return {
+            'format_pattern': format_pattern,
+            'profiles': profiles,
+            'sequences': sequences}
+
+    def __get_pattern(self, profile_name: str) -> Dict[str, Union[str, list]]:
+        # The patterns are parsed once and the alias tables of their weighted
+        # alternatives are built once, so each draw takes a constant time.
+        pattern = self.__patterns.get(profile_name)
+        if pattern is not None:
+            return pattern
+        profile = self.__config.get_profile(profile_name)
+        if not profile:
+            raise self.GeneratorException(
+                'The profile is not defined.', profile_name)
+        try:
+            pattern = self.__parse_pattern(profile['pattern'])
+            if profile_name in pattern['profiles'] and \
+                    pattern['profiles'] != [profile_name]:
+                raise self.GeneratorException(
+                    'The user defined pattern must not contain its '
+                    'profile: {}'.format(profile['pattern']))
+            for sequence in pattern['sequences']:
+                sequence['alias_table'] = None
+                if len(sequence['profiles']) > 1:
+                    sequence['alias_table'] = AliasTable(sequence['weights'])
+        except self.GeneratorException as e:
+            raise self.GeneratorException(
+                str(e), profile_name, e.source_exception)
+        self.__patterns[profile_name] = pattern
+        return pattern
+
+    def __get_list_alias_table(
+            self,
+            profile_name: str,
+            code_name_list: Tuple[str, ...]) -> Optional[AliasTable]:
+        # The table is rebuilt only if the list has been rebuilt.
+        alias_table_data = self.__list_alias_tables.get(profile_name)
+        if alias_table_data and alias_table_data[0] is code_name_list:
+            return alias_table_data[1]
+        profile = self.__get_code_name_list_profile(profile_name)
+        weights = profile['code_name_list'].get('weights')
+        alias_table = None
+        if weights:
+            try:
+                alias_table = AliasTable(
+                    [weights.get(x, 1) for x in code_name_list])
+            except AliasTable.AliasTableException as e:
+                raise self.GeneratorException(
+                    str(e), profile_name, e.source_exception)
+        self.__list_alias_tables[profile_name] = (code_name_list, alias_table)
+        return alias_table
 
     def __format_code_name(self, code_name, profile) -> str:
         transformed_code_name = code_name
@@ -90,16 +290,40 @@ class Generator:
             return None
         return validation_result.group(0)
 
-    def __get_code_name_list(self, profile_name: str) -> None:
+    def __get_leaf_profile_names(
+            self, profile_name: str, visited: set = None) -> List[str]:
+        if visited is None:
+            visited = set()
+        if profile_name in visited:
+            return []
+        visited.add(profile_name)
+        subprofile_names = self.__get_pattern(profile_name)['profiles']
+        if subprofile_names == [profile_name]:
+            return [profile_name]
+        leaf_profile_names = []
+        for subprofile_name in subprofile_names:
+            for leaf_profile_name in self.__get_leaf_profile_names(
+                    subprofile_name, visited):
+                if leaf_profile_name not in leaf_profile_names:
+                    leaf_profile_names.append(leaf_profile_name)
+        return leaf_profile_names
+
+    def __load_code_name_list(
+            self, profile_name: str) -> Optional[Tuple[str, ...]]:
+        # The lists are shared by all threads, so they are kept as tuples and
+        # never modified after they have been loaded.
+        code_name_list = self.__code_name_lists.get(profile_name)
+        if code_name_list is not None:
+            return code_name_list
         cache_name = 'profile_' + profile_name
         cache_data = self.__cache.read(cache_name)
         if cache_data:
-            return json.loads(cache_data)
-        if not self.__quiet:
-            print('\r{}Fetching data for the profile: {}{}'.format(
-                Fore.YELLOW, profile_name, Fore.RESET),
-                end='')
-        code_name_list = []
+            code_name_list = tuple(json.loads(cache_data))
+            self.__code_name_lists[profile_name] = code_name_list
+            return code_name_list
+        return None
+
+    def __get_code_name_list_profile(self, profile_name: str) -> dict:
         profile = self.__config.get_profile(profile_name)
         if not profile:
             raise self.GeneratorException(
@@ -108,6 +332,18 @@ class Generator:
             raise self.GeneratorException(
                 'The profile does not define a list of code names.',
                 profile_name)
+        return profile
+
+    def __build_code_name_list(
+            self,
+            profile_name: str,
+            progress: 'Generator.__Progress',
+            executor: concurrent.futures.Executor = None,
+            parse_executor: concurrent.futures.Executor = None,
+            refresh: bool = False,
+            page_store: PageStore = None) -> Tuple[str, ...]:
+        code_name_list = []
+        profile = self.__get_code_name_list_profile(profile_name)
         pages = profile['code_name_list']['pages']
         sources = profile['code_name_list']['sources']
         wikipedia_url = self.__config.get_wikipedia_url()
@@ -116,36 +352,404 @@ class Generator:
             wikipedia_url = profile['code_name_list']['wikipedia_url']
         if profile['code_name_list']['excluded_sections']:
             excluded_sections = profile['code_name_list']['excluded_sections']
-        data = WikiData(self.__cache, wikipedia_url)
-        for page in pages:
-            if not self.__quiet:
-                print(
-                    '\r{}Fetching data for the profile: {} '
-                    '(page {}/{}){}'.format(
-                        Fore.YELLOW,
-                        profile_name,
-                        pages.index(page) + 1,
-                        len(pages),
-                        Fore.RESET),
-                    end='')
-            data.fetch(page, excluded_sections, wikipedia_url)
-            for i in range(data.get_table_count()):
-                for header in sources['tables']:
-                    code_name_list += data.get_table_values_by_header(
-                        i, header)
-            for i in range(data.get_list_count()):
-                if sources['lists']:
-                    code_name_list += data.get_list_values(i)
-            code_name_list = [
-                self.__format_code_name(x, profile) for x in code_name_list]
-            code_name_list = [x for x in code_name_list if x]
+        data = WikiData(
+            self.__cache,
+            wikipedia_url,
+            self.__stats,
+            executor,
+            parse_executor,
+            self.__scheduler,
+            refresh,
+            page_store=page_store)
+        for page_index, page in enumerate(pages):
+            progress.start_page(profile_name, page_index)
+            # The values are transformed and validated while the next
+            # sections are still being downloaded, but they are put in the
+            # order of the sections, with the values of all tables first, so
+            # the list does not depend on the download order.
+            table_code_names: Dict[int, List[str]] = {}
+            list_code_names: Dict[int, List[str]] = {}
+            extracted_count = 0
+            accepted_count = 0
+            transform_time = 0.0
+            for value in data.iter_values(
+                    page,
+                    sources['tables'],
+                    sources['lists'],
+                    excluded_sections,
+                    wikipedia_url):
+                extracted_count += 1
+                start_time = time.perf_counter()
+                code_name = self.__format_code_name(value.text, profile)
+                transform_time += time.perf_counter() - start_time
+                if not code_name:
+                    continue
+                accepted_count += 1
+                if value.source == WikiData.TABLE_SOURCE:
+                    section_code_names = table_code_names
+                else:
+                    section_code_names = list_code_names
+                section_code_names.setdefault(
+                    value.section_index, []).append(code_name)
+            for section_code_names in [table_code_names, list_code_names]:
+                for section_index in sorted(section_code_names):
+                    code_name_list += section_code_names[section_index]
+            self.__stats.increment('generator.transform_time', transform_time)
+            self.__stats.increment(
+                'generator.extracted_value_count', extracted_count)
+            self.__stats.increment(
+                'generator.rejected_value_count',
+                extracted_count - accepted_count)
         cache_data = json.dumps(code_name_list)
-        self.__cache.write(cache_name, cache_data)
-        if not self.__quiet:
-            print('\r{}Fetched data for the profile: {}{}{}'.format(
-                Fore.GREEN, profile_name, ' ' * (9 + 2 * 4), Fore.RESET))
+        self.__cache.write('profile_' + profile_name, cache_data)
+        self.__code_name_lists[profile_name] = tuple(code_name_list)
+        progress.finish_profile(profile_name)
+        return self.__code_name_lists[profile_name]
+
+    def __get_code_name_list(self, profile_name: str) -> Tuple[str, ...]:
+        code_name_list = self.__load_code_name_list(profile_name)
+        if code_name_list is not None:
+            return code_name_list
+        with self.__build_lock:
+            code_name_list = self.__load_code_name_list(profile_name)
+            if code_name_list is not None:
+                return code_name_list
+            progress = self.__create_progress([profile_name])
+            with concurrent.futures.ProcessPoolExecutor() as parse_executor:
+                code_name_list = self.__build_code_name_list(
+                    profile_name, progress, None, parse_executor)
+            progress.finish()
         return code_name_list
 
+    def __create_progress(
+            self, profile_names: List[str]) -> 'Generator.__Progress':
+        page_counts = {}
+        for profile_name in profile_names:
+            profile = self.__get_code_name_list_profile(profile_name)
+            page_counts[profile_name] = len(
+                profile['code_name_list']['pages'])
+        return Generator.__Progress(page_counts, self.__quiet)
+
+    def __build_code_name_lists(
+            self, profile_names: List[str], refresh: bool = False) -> None:
+        progress = self.__create_progress(profile_names)
+        # The sections of all pages are downloaded by a single shared pool
+        # and parsed by a single shared pool of processes, while each list is
+        # built by its own thread. The pools must be separate, because the
+        # building threads wait for the downloads. The sections are shared
+        # by all lists, so a page used by several lists is downloaded and
+        # parsed only once.
+        page_store = PageStore()
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.__scheduler.get_max_concurrency()) \
+                as fetch_executor, \
+                concurrent.futures.ProcessPoolExecutor() as parse_executor, \
+                concurrent.futures.ThreadPoolExecutor(
+                    max_workers=len(profile_names)) as build_executor:
+            future_list = [
+                build_executor.submit(
+                    self.__build_code_name_list,
+                    x,
+                    progress,
+                    fetch_executor,
+                    parse_executor,
+                    refresh,
+                    page_store)
+                for x in profile_names]
+            for future in concurrent.futures.as_completed(future_list):
+                future.result()
+        progress.finish()
+
+    def __prepare_code_name_lists(self, profile_name: str) -> None:
+        # On the first draw, all the leaves of the pattern are built
+        # concurrently, instead of one by one while the pattern is resolved.
+        if profile_name in self.__prepared_profile_names:
+            return
+        leaf_profile_names = self.__get_leaf_profile_names(profile_name)
+        if any(self.__load_code_name_list(x) is None
+               for x in leaf_profile_names):
+            with self.__build_lock:
+                missing_profile_names = [
+                    x for x in leaf_profile_names
+                    if self.__load_code_name_list(x) is None]
+                if missing_profile_names:
+                    self.__build_code_name_lists(missing_profile_names)
+        self.__prepared_profile_names.add(profile_name)
+
+    def __count_draw_attempt(self, profile_name: str, code_name: str):
+        self.__stats.increment(
+            'generator.draw_attempt_count.' + profile_name)
+        if not code_name:
+            self.__stats.increment(
+                'generator.rejected_draw_count.' + profile_name)
+        # The counters are not locked, because an attempt rarely missed by
+        # concurrent threads does not affect the estimates.
+        delta = self.__estimate_deltas.get(profile_name)
+        if delta is None:
+            delta = self.__estimate_deltas.setdefault(profile_name, [0, 0])
+        delta[0] += 1
+        if code_name:
+            delta[1] += 1
+
+    def __read_estimates(self) -> Dict[str, Dict[str, Union[str, int]]]:
+        # The estimates of the profiles that have changed since they were
+        # measured are discarded.
+        cache_data = self.__cache.read(self.ESTIMATE_CACHE_NAME)
+        try:
+            estimates = json.loads(cache_data) if cache_data else {}
+        except ValueError:
+            estimates = {}
+        return {
+            name: estimate for name, estimate in estimates.items()
+            if estimate.get('version') ==
+            self.__config.get_profile_version(name)}
+
+    def __merge_estimate_deltas(
+            self, estimate_deltas: Dict[str, List[int]]) -> None:
+        with self.__estimate_lock:
+            for profile_name, delta in estimate_deltas.items():
+                merged_delta = self.__estimate_deltas.setdefault(
+                    profile_name, [0, 0])
+                merged_delta[0] += delta[0]
+                merged_delta[1] += delta[1]
+
+    def __save_estimates(self, force: bool = False) -> None:
+        # The estimates are merged with the ones saved in the meantime by
+        # other processes sharing the cache. Unless forced, they are only
+        # saved after enough draws or time, so frequent short generations
+        # do not rewrite the cache each time.
+        with self.__estimate_lock:
+            if not self.__estimate_deltas:
+                return
+            if not force and sum(
+                    x[0] for x in self.__estimate_deltas.values()) < \
+                    self.ESTIMATE_SAVE_DRAW_COUNT and \
+                    time.monotonic() - self.__estimate_save_time < \
+                    self.ESTIMATE_SAVE_INTERVAL:
+                return
+            estimate_deltas = self.__estimate_deltas
+            self.__estimate_deltas = {}
+            estimates = self.__read_estimates()
+            for profile_name, delta in estimate_deltas.items():
+                estimate = estimates.setdefault(profile_name, {
+                    'version': self.__config.get_profile_version(
+                        profile_name),
+                    'draw_count': 0,
+                    'accepted_count': 0})
+                estimate['draw_count'] += delta[0]
+                estimate['accepted_count'] += delta[1]
+            for profile_name, distinct_count_data in \
+                    self.__distinct_counts.items():
+                if profile_name in estimates:
+                    estimates[profile_name]['distinct_count'] = \
+                        distinct_count_data[1]
+            self.__cache.write(self.ESTIMATE_CACHE_NAME, json.dumps(estimates))
+            self.__estimates = estimates
+            self.__estimate_save_time = time.monotonic()
+
+    def __get_draw_counts(self, profile_name: str) -> Tuple[int, int]:
+        with self.__estimate_lock:
+            if self.__estimates is None:
+                self.__estimates = self.__read_estimates()
+            estimate = self.__estimates.get(profile_name, {})
+            delta = self.__estimate_deltas.get(profile_name, [0, 0])
+            return (
+                estimate.get('draw_count', 0) + delta[0],
+                estimate.get('accepted_count', 0) + delta[1])
+
+    def __get_acceptance_rate(self, profile_name: str) -> Optional[float]:
+        # The rate is smoothed, so it is never zero nor one.
+        draw_count, accepted_count = self.__get_draw_counts(profile_name)
+        if draw_count < self.ESTIMATE_MIN_DRAW_COUNT:
+            return None
+        return (accepted_count + 1) / (draw_count + 2)
+
+    def __get_attempt_budget(self, success_rate: Optional[float]) -> int:
+        # The budget is large enough to find a code name unless something is
+        # very unlikely. It only ever raises the maximum number of attempts,
+        # up to a multiple of it.
+        if success_rate is None:
+            return max(self.__max_attempt_count, self.ESTIMATE_MIN_DRAW_COUNT)
+        max_budget = self.__max_attempt_count * self.ATTEMPT_BUDGET_FACTOR
+        if success_rate >= 1:
+            return self.__max_attempt_count
+        if success_rate <= 0:
+            return max_budget
+        budget = math.ceil(
+            math.log(self.MAX_FAILURE_PROBABILITY) /
+            math.log1p(-success_rate))
+        return max(self.__max_attempt_count, min(budget, max_budget))
+
+    def __get_distinct_count(self, profile_name: str) -> int:
+        # The number of distinct code names of a leaf is exact. Otherwise, it
+        # is the upper bound, because the transformation and the validation
+        # can only merge or reject code names.
+        pattern = self.__get_pattern(profile_name)
+        if pattern['profiles'] == [profile_name]:
+            code_name_list = self.__get_code_name_list(profile_name)
+            distinct_count_data = self.__distinct_counts.get(profile_name)
+            if distinct_count_data and \
+                    distinct_count_data[0] is code_name_list:
+                return distinct_count_data[1]
+            profile = self.__get_code_name_list_profile(profile_name)
+            weights = profile['code_name_list'].get('weights') or {}
+            distinct_count = len(set(
+                x for x in code_name_list if weights.get(x, 1) > 0))
+            self.__distinct_counts[profile_name] = (
+                code_name_list, distinct_count)
+            return distinct_count
+        view = self.__get_view(profile_name)
+        if view:
+            return len(view['code_names'])
+        return self.__get_combination_count(profile_name)
+
+    def __get_combination_count(self, profile_name: str) -> int:
+        combination_count = 1
+        for sequence in self.__get_pattern(profile_name)['sequences']:
+            combination_count *= sum(
+                self.__get_distinct_count(x) for x in sequence['profiles'])
+        return combination_count
+
+    def __get_expected_draw_count(self, profile_name: str) -> float:
+        # The expected number of draws from the leaves per code name.
+        pattern = self.__get_pattern(profile_name)
+        if pattern['profiles'] == [profile_name] or \
+                self.__get_view(profile_name):
+            return 1.0
+        draw_count = 0.0
+        for sequence in pattern['sequences']:
+            total_weight = math.fsum(sequence['weights'])
+            draw_count += math.fsum(
+                weight / total_weight * self.__get_expected_draw_count(name)
+                for name, weight in zip(
+                    sequence['profiles'], sequence['weights']))
+        acceptance_rate = self.__get_acceptance_rate(profile_name)
+        if acceptance_rate is not None:
+            draw_count /= acceptance_rate
+        return draw_count
+
+    def __get_list_hash(self, profile_name: str) -> str:
+        code_name_list = self.__get_code_name_list(profile_name)
+        list_hash_data = self.__list_hashes.get(profile_name)
+        if list_hash_data and list_hash_data[0] is code_name_list:
+            return list_hash_data[1]
+        hash = hashlib.sha1()
+        hash.update(json.dumps(code_name_list).encode('utf-8'))
+        self.__list_hashes[profile_name] = (code_name_list, hash.hexdigest())
+        return self.__list_hashes[profile_name][1]
+
+    def __get_fingerprint(self, profile_name: str) -> str:
+        # The fingerprint changes whenever the profile, any of its subprofiles
+        # or any of their lists change.
+        profile_names = [profile_name]
+        for name in profile_names:
+            for subprofile_name in self.__get_pattern(name)['profiles']:
+                if subprofile_name not in profile_names:
+                    profile_names.append(subprofile_name)
+        hash = hashlib.sha1()
+        for name in sorted(profile_names):
+            hash.update(self.__config.get_profile_version(name).encode(
+                'utf-8'))
+            if self.__get_pattern(name)['profiles'] == [name]:
+                hash.update(self.__get_list_hash(name).encode('utf-8'))
+        return hash.hexdigest()
+
+    def __get_distribution(
+            self, profile_name: str) -> Tuple[Tuple[str, ...], List[float]]:
+        view = self.__get_view(profile_name)
+        if view:
+            return view['code_names'], view['weights']
+        code_name_list = self.__get_code_name_list(profile_name)
+        profile = self.__get_code_name_list_profile(profile_name)
+        weights = profile['code_name_list'].get('weights') or {}
+        distribution: Dict[str, float] = {}
+        for code_name in code_name_list:
+            distribution[code_name] = \
+                distribution.get(code_name, 0) + weights.get(code_name, 1)
+        distribution = {x: y for x, y in distribution.items() if y > 0}
+        return tuple(distribution.keys()), list(distribution.values())
+
+    def __materialize(
+            self, profile_name: str) -> Tuple[Tuple[str, ...], List[float]]:
+        # Each valid code name is weighted by the probability of drawing it,
+        # so drawing from the view is the same as drawing until a code name
+        # is valid.
+        profile = self.__config.get_profile(profile_name)
+        pattern = self.__get_pattern(profile_name)
+        sequence_distributions = []
+        for sequence in pattern['sequences']:
+            sequence_distribution: Dict[str, float] = {}
+            total_weight = math.fsum(sequence['weights'])
+            for subprofile_name, weight in zip(
+                    sequence['profiles'], sequence['weights']):
+                code_names, code_name_weights = self.__get_distribution(
+                    subprofile_name)
+                total_code_name_weight = math.fsum(code_name_weights)
+                for code_name, code_name_weight in zip(
+                        code_names, code_name_weights):
+                    sequence_distribution[code_name] = \
+                        sequence_distribution.get(code_name, 0) + \
+                        weight / total_weight * \
+                        code_name_weight / total_code_name_weight
+            sequence_distributions.append(
+                list(sequence_distribution.items()))
+        distribution: Dict[str, float] = {}
+        for combination in itertools.product(*sequence_distributions):
+            code_name = self.__format_code_name(
+                pattern['format_pattern'].format(
+                    *[x[0] for x in combination]),
+                profile)
+            if code_name:
+                distribution[code_name] = distribution.get(code_name, 0) + \
+                    math.prod(x[1] for x in combination)
+        return tuple(distribution.keys()), list(distribution.values())
+
+    def __get_view(self, profile_name: str) -> Optional[dict]:
+        # A composite profile with few enough combinations is replaced by
+        # the list of all its valid code names, which is saved in the cache.
+        if not self.__materialize_threshold:
+            return None
+        if profile_name in self.__views:
+            return self.__views[profile_name]
+        with self.__build_lock:
+            if profile_name in self.__views:
+                return self.__views[profile_name]
+            view = None
+            self.__prepare_code_name_lists(profile_name)
+            pattern = self.__get_pattern(profile_name)
+            if pattern['profiles'] != [profile_name] and \
+                    self.__get_combination_count(profile_name) <= \
+                    self.__materialize_threshold:
+                cache_name = self.VIEW_CACHE_NAME_PREFIX + profile_name
+                fingerprint = self.__get_fingerprint(profile_name)
+                cache_data = self.__cache.read(cache_name)
+                view_data = json.loads(cache_data) if cache_data else None
+                if not view_data or view_data['fingerprint'] != fingerprint:
+                    with self.__stats.measure(
+                            'generator.materialization_time'):
+                        code_names, weights = self.__materialize(profile_name)
+                    view_data = {
+                        'fingerprint': fingerprint,
+                        'code_names': code_names,
+                        'weights': weights}
+                    self.__cache.write(cache_name, json.dumps(view_data))
+                view = {
+                    'code_names': tuple(view_data['code_names']),
+                    'weights': view_data['weights'],
+                    'alias_table': None}
+                if view['code_names']:
+                    view['alias_table'] = AliasTable(view['weights'])
+            self.__views[profile_name] = view
+            return view
+
+    def __calibrate(self, profile_name: str) -> None:
+        draw_count = self.__get_draw_counts(profile_name)[0]
+        for _ in range(self.ESTIMATE_MIN_DRAW_COUNT - draw_count):
+            try:
+                self.__get_code_name(profile_name)
+            except self.GeneratorException:
+                break
+
     def __get_code_name(self, profile_name: str) -> str:
         attempt_count = 0
         code_name = None
@@ -153,80 +757,454 @@ class Generator:
         if not profile:
             raise self.GeneratorException(
                 'The profile is not defined.', profile_name)
-        pattern_data = profile['pattern']
-        pattern = self.__parse_pattern(pattern_data)
+        self.__prepare_code_name_lists(profile_name)
+        view = self.__get_view(profile_name)
+        if view:
+            if not view['code_names']:
+                raise self.GeneratorException(
+                    'No code name match the profile.',
+                    profile_name)
+            # The draws from a view are always accepted, so they are not
+            # counted as attempts, which would skew the acceptance rate.
+            code_name = view['code_names'][
+                view['alias_table'].sample(self.__get_random())]
+            self.__stats.increment('generator.view_draw_count.' + profile_name)
+            return code_name
+        pattern = self.__get_pattern(profile_name)
         format_pattern = pattern['format_pattern']
         subprofile_names = pattern['profiles']
-        subprofile_count = len(pattern['profiles'])
-        if subprofile_count > 1:
-            while not code_name and attempt_count < self.__max_attempt_count:
-                subprofile_code_names = []
-                if profile_name in subprofile_names:
-                    raise self.GeneratorException(
-                        'The user defined pattern must not contain its '
-                        'profile: {}'.format(
-                            pattern_data),
-                        profile_name)
-                for subprofile_name in subprofile_names:
-                    subprofile_code_names.append(
-                        self.__get_code_name(subprofile_name))
-                code_name = self.__format_code_name(
-                    format_pattern.format(*subprofile_code_names), profile)
-                attempt_count += 1
-        elif subprofile_count == 1:
-            subprofile_name = subprofile_names[0]
-            if profile_name == subprofile_name:
-                code_name_list = self.__get_code_name_list(subprofile_name)
-                if len(code_name_list) == 0:
-                    raise self.GeneratorException(
-                        'No code name match the profile.',
-                        profile_name)
-                code_name_index = random.randrange(0, len(code_name_list))
-                code_name = code_name_list[code_name_index]
-            else:
-                while not code_name and attempt_count < self.__max_attempt_count:
-                    subprofile_code_name = self.__get_code_name(
-                        subprofile_name)
-                    code_name = self.__format_code_name(
-                        format_pattern.format(subprofile_code_name), profile)
-                    attempt_count += 1
-        else:
+        sequences = pattern['sequences']
+        if not sequences:
             raise self.GeneratorException(
                 'The pattern does not contain any profile: {}'.format(
                     profile['pattern']),
                 profile_name)
+        if subprofile_names == [profile_name]:
+            code_name_list = self.__get_code_name_list(profile_name)
+            if len(code_name_list) == 0:
+                raise self.GeneratorException(
+                    'No code name match the profile.',
+                    profile_name)
+            alias_table = self.__get_list_alias_table(
+                profile_name, code_name_list)
+            if alias_table:
+                code_name_index = alias_table.sample(self.__get_random())
+            else:
+                code_name_index = self.__get_random().randrange(
+                    0, len(code_name_list))
+            code_name = code_name_list[code_name_index]
+            self.__count_draw_attempt(profile_name, code_name)
+        else:
+            # The budget is evaluated again when it runs out, because the
+            # attempts themselves may improve or establish the estimate.
+            attempt_budget = self.__attempt_budgets.get(profile_name, 0)
+            while not code_name:
+                if attempt_count >= attempt_budget:
+                    attempt_budget = self.__get_attempt_budget(
+                        self.__get_acceptance_rate(profile_name))
+                    self.__attempt_budgets[profile_name] = attempt_budget
+                    if attempt_count >= attempt_budget:
+                        break
+                subprofile_code_names = []
+                for sequence in sequences:
+                    alternative_index = 0
+                    if sequence['alias_table']:
+                        alternative_index = sequence['alias_table'].sample(
+                            self.__get_random())
+                    subprofile_code_names.append(self.__get_code_name(
+                        sequence['profiles'][alternative_index]))
+                code_name = self.__format_code_name(
+                    format_pattern.format(*subprofile_code_names), profile)
+                attempt_count += 1
+                self.__count_draw_attempt(profile_name, code_name)
         if not code_name:
             raise self.GeneratorException(
                 'The maximum number of attempts has been reached.')
         return code_name
 
-    def generate(self, profile_name: str, count: int) -> List[str]:
+    def __is_issued(self, profile_name: str, code_name: str) -> bool:
+        if not self.__registry:
+            return False
+        return self.__registry.contains(profile_name, code_name)
+
+    def __get_remaining_count(self, profile_name: str) -> int:
+        # The registered code names are never generated again, so they are
+        # not left to draw.
+        distinct_count = self.__get_distinct_count(profile_name)
+        if not self.__registry:
+            return distinct_count
+        return max(
+            0, distinct_count - self.__registry.get_count(profile_name))
+
+    def __iter_serial(self, profile_name: str) -> Iterator[str]:
+        # The code names are drawn until all the remaining code names have
+        # been drawn or until so many duplicates in a row have been drawn,
+        # that a remaining code name is unlikely to be left.
+        self.__prepare_code_name_lists(profile_name)
+        distinct_count = self.__get_distinct_count(profile_name)
+        remaining_count = self.__get_remaining_count(profile_name)
         attempt_count = 0
-        code_name_list: list[str] = []
-        try:
-            while len(code_name_list) < count and \
-                    attempt_count < self.__max_attempt_count:
-                code_name = self.__get_code_name(profile_name)
-                if code_name not in code_name_list:
-                    code_name_list.append(code_name)
+        code_name_set = set()
+        while len(code_name_set) < remaining_count:
+            code_name = self.__get_code_name(profile_name)
+            if code_name in code_name_set or \
+                    self.__is_issued(profile_name, code_name):
+                self.__stats.increment(
+                    'generator.duplicate_count.' + profile_name)
                 attempt_count += 1
+                if attempt_count >= self.__max_attempt_count and \
+                        attempt_count >= self.__get_attempt_budget(
+                            (remaining_count - len(code_name_set)) /
+                            distinct_count):
+                    break
+                continue
+            code_name_set.add(code_name)
+            attempt_count = 0
+            yield code_name
+
+    def __iter_parallel(
+            self, profile_name: str, count: Optional[int]) -> Iterator[str]:
+        # The leaf lists are built once here, so the workers only read them
+        # from the cache instead of fetching the same pages concurrently.
+        self.__prepare_code_name_lists(profile_name)
+        remaining_count = self.__get_remaining_count(profile_name)
+        base_seed = self.__get_random().getrandbits(64)
+        code_name_set = set()
+        yielded_count = 0
+        round_index = 0
+        # Each worker process loads the lists once, and only the seed
+        # changes from one round to the next.
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.__worker_count,
+                initializer=_setup_worker,
+                initargs=(
+                    self.__config,
+                    self.__cache.get_base_path(),
+                    self.__max_attempt_count,
+                    self.__materialize_threshold)) as executor:
+            while True:
+                if count is None:
+                    quota = self.PARALLEL_CHUNK_SIZE
+                else:
+                    missing_count = max(count - yielded_count, 1)
+                    quota = -(-missing_count // self.__worker_count)
+                future_list = []
+                for worker_index in range(self.__worker_count):
+                    future = executor.submit(
+                        _generate_worker,
+                        profile_name,
+                        quota,
+                        '{}:{}:{}'.format(
+                            base_seed, round_index, worker_index))
+                    future_list.append(future)
+                results = []
+                for future in future_list:
+                    result, counters, estimate_deltas = future.result()
+                    self.__stats.merge(counters)
+                    self.__merge_estimate_deltas(estimate_deltas)
+                    results.append(result)
+                added_count = 0
+                for i in range(max(len(x) for x in results)):
+                    for result in results:
+                        if i >= len(result):
+                            continue
+                        code_name = result[i]
+                        if code_name in code_name_set or \
+                                self.__is_issued(profile_name, code_name):
+                            self.__stats.increment(
+                                'generator.duplicate_count.' + profile_name)
+                            continue
+                        code_name_set.add(code_name)
+                        added_count += 1
+                        yielded_count += 1
+                        yield code_name
+                if added_count == 0 or yielded_count >= remaining_count:
+                    break
+                round_index += 1
+
+    def __release(self, profile_name: str, code_names: List[str]) -> None:
+        try:
+            self.__registry.unregister(profile_name, code_names)
+        except Registry.RegistryException as e:
+            raise self.GeneratorException(
+                str(e), profile_name, e.source_exception)
+
+    def __iter_registered(
+            self,
+            profile_name: str,
+            code_names: Iterator[str],
+            count: Optional[int]) -> Iterator[str]:
+        # Other processes may register some of the code names in the
+        # meantime, so the code names are claimed in batches before they are
+        # issued. The batches grow, so the first code name is issued
+        # immediately, but never beyond the number of code names still
+        # missing, so no claimed code name is left unissued.
+        batch_size = 1
+        batch = []
+        yielded_count = 0
+        for code_name in code_names:
+            batch.append(code_name)
+            if len(batch) >= batch_size or (
+                    count is not None and
+                    len(batch) >= count - yielded_count):
+                for registered_code_name in self.__registry.register(
+                        profile_name, batch):
+                    yielded_count += 1
+                    yield registered_code_name
+                batch = []
+                batch_size = min(2 * batch_size, self.REGISTRY_BATCH_SIZE)
+                if count is not None and yielded_count >= count:
+                    return
+        if batch:
+            yield from self.__registry.register(profile_name, batch)
+
+    def iter_generate(
+            self,
+            profile_name: str,
+            count: Optional[int] = None) -> Iterator[str]:
+        try:
+            if count is not None:
+                # The number of distinct code names is known after the lists
+                # have been built, so an impossible request fails before any
+                # draw.
+                self.__prepare_code_name_lists(profile_name)
+                remaining_count = self.__get_remaining_count(profile_name)
+                if count > remaining_count:
+                    raise self.GeneratorException(
+                        'The number of code names is greater than the '
+                        'number of distinct code names: {} > {}'.format(
+                            count, remaining_count),
+                        profile_name)
+            if self.__worker_count > 1:
+                code_names = self.__iter_parallel(profile_name, count)
+            else:
+                code_names = self.__iter_serial(profile_name)
+            if self.__registry:
+                code_names = self.__iter_registered(
+                    profile_name, code_names, count)
+            if count is not None:
+                code_names = itertools.islice(code_names, count)
+            yielded_count = 0
+            for code_name in code_names:
+                yielded_count += 1
+                yield code_name
+            if count is not None and yielded_count < count:
+                raise self.GeneratorException(
+                    'The maximum number of attempts has been reached.')
         except Cache.CacheException as e:
             raise self.GeneratorException(
                 str(e), profile_name, e.source_exception)
         except WikiData.WikiDataException as e:
             raise self.GeneratorException(
                 str(e), profile_name, e.source_exception)
-        if len(code_name_list) < count:
+        except Registry.RegistryException as e:
             raise self.GeneratorException(
-                'The maximum number of attempts has been reached.')
-        return code_name_list
+                str(e), profile_name, e.source_exception)
+        finally:
+            # The estimates only affect the performance, so they are saved
+            # on a best effort basis.
+            if self.__save_estimates_enabled:
+                try:
+                    self.__save_estimates()
+                except Cache.CacheException:
+                    pass
 
-    def generate_all(self, profile_name: str) -> List[str]:
+    def prefetch(
+            self,
+            profile_names: List[str] = None,
+            refresh: bool = False) -> List[str]:
+        if not profile_names:
+            profile_names = self.__config.get_profile_name_list()
+        try:
+            leaf_profile_names = []
+            for profile_name in profile_names:
+                for leaf_profile_name in self.__get_leaf_profile_names(
+                        profile_name):
+                    if leaf_profile_name not in leaf_profile_names:
+                        leaf_profile_names.append(leaf_profile_name)
+            # When refreshing, all the lists are rebuilt, but only the pages
+            # that have changed since they were cached are downloaded again.
+            with self.__build_lock:
+                missing_profile_names = [
+                    x for x in leaf_profile_names
+                    if refresh or self.__load_code_name_list(x) is None]
+                if missing_profile_names:
+                    self.__build_code_name_lists(
+                        missing_profile_names, refresh)
+                if refresh:
+                    self.__views = {}
+        except Cache.CacheException as e:
+            raise self.GeneratorException(
+                str(e), None, e.source_exception)
+        except WikiData.WikiDataException as e:
+            raise self.GeneratorException(
+                str(e), None, e.source_exception)
+        return leaf_profile_names
+
+    def export_bundle(self, file_path: str) -> List[str]:
+        profile_names = self.prefetch()
+        code_name_lists = {}
+        try:
+            for profile_name in profile_names:
+                code_name_lists[profile_name] = (
+                    self.__config.get_profile_version(profile_name),
+                    self.__get_code_name_list(profile_name))
+            Bundle(file_path).write(
+                self.__config.get_version(), code_name_lists)
+        except Cache.CacheException as e:
+            raise self.GeneratorException(
+                str(e), None, e.source_exception)
+        except Bundle.BundleException as e:
+            raise self.GeneratorException(
+                str(e), None, e.source_exception)
+        return profile_names
+
+    def import_bundle(self, file_path: str) -> List[str]:
+        try:
+            _, code_name_lists = Bundle(file_path).read()
+            mismatched_profile_names = [
+                x for x, (profile_version, _) in code_name_lists.items()
+                if profile_version != self.__config.get_profile_version(x)]
+            if mismatched_profile_names:
+                raise self.GeneratorException(
+                    'The bundle does not match the configuration of the '
+                    'profiles: {}'.format(
+                        ', '.join(sorted(mismatched_profile_names))))
+            for profile_name, (_, code_name_list) in code_name_lists.items():
+                self.__cache.write(
+                    'profile_' + profile_name, json.dumps(code_name_list))
+                self.__code_name_lists[profile_name] = tuple(code_name_list)
+        except Cache.CacheException as e:
+            raise self.GeneratorException(
+                str(e), None, e.source_exception)
+        except Bundle.BundleException as e:
+            raise self.GeneratorException(
+                str(e), None, e.source_exception)
+        return list(code_name_lists.keys())
+
+    def get_stats(self) -> Stats:
+        return self.__stats
+
+    def flush_estimates(self) -> None:
+        if not self.__save_estimates_enabled:
+            return
+        try:
+            self.__save_estimates(True)
+        except Cache.CacheException:
+            pass
+
+    def pop_estimate_deltas(self) -> Dict[str, List[int]]:
+        with self.__estimate_lock:
+            estimate_deltas = self.__estimate_deltas
+            self.__estimate_deltas = {}
+            return estimate_deltas
+
+    def set_seed(self, seed: Optional[Union[int, str]]) -> None:
+        # The generators of all the threads are seeded again on their next
+        # draw.
+        with self.__random_lock:
+            self.__seed = seed
+            self.__random_count = 0
+            self.__local = threading.local()
+
+    def iter_generate_all(self, profile_name: str) -> Iterator[str]:
         try:
-            return self.__get_code_name_list(profile_name)
+            view = self.__get_view(profile_name)
+            if view:
+                code_name_list = view['code_names']
+            else:
+                code_name_list = self.__get_code_name_list(profile_name)
         except Cache.CacheException as e:
             raise self.GeneratorException(
                 str(e), profile_name, e.source_exception)
         except WikiData.WikiDataException as e:
             raise self.GeneratorException(
                 str(e), profile_name, e.source_exception)
+        yield from code_name_list
+
+    def get_estimate(self, profile_name: str) -> Dict[str, Optional[float]]:
+        try:
+            self.__prepare_code_name_lists(profile_name)
+            self.__calibrate(profile_name)
+            draw_count, accepted_count = self.__get_draw_counts(profile_name)
+            estimate = {
+                'acceptance_rate':
+                    accepted_count / draw_count if draw_count else None,
+                'distinct_count': self.__get_distinct_count(profile_name),
+                'expected_draw_count':
+                    self.__get_expected_draw_count(profile_name),
+                'attempt_budget': self.__get_attempt_budget(
+                    self.__get_acceptance_rate(profile_name))}
+            self.__save_estimates(True)
+        except Cache.CacheException as e:
+            raise self.GeneratorException(
+                str(e), profile_name, e.source_exception)
+        except WikiData.WikiDataException as e:
+            raise self.GeneratorException(
+                str(e), profile_name, e.source_exception)
+        return estimate
+
+    def generate(self, profile_name: str, count: int) -> List[str]:
+        # The code names of a failed generation are never issued, so the
+        # ones it has registered are released.
+        code_name_list = []
+        try:
+            for code_name in self.iter_generate(profile_name, count):
+                code_name_list.append(code_name)
+        except self.GeneratorException:
+            if self.__registry and code_name_list:
+                self.__release(profile_name, code_name_list)
+            raise
+        return code_name_list
+
+    def generate_all(self, profile_name: str) -> List[str]:
+        return list(self.iter_generate_all(profile_name))
+
+    def generate_many(self, counts: Dict[str, int]) -> Dict[str, List[str]]:
+        # The leaves shared by the profiles are resolved and built once,
+        # concurrently, before any code name is generated.
+        if not counts:
+            return {}
+        self.prefetch(list(counts.keys()))
+        return {
+            profile_name: self.generate(profile_name, count)
+            for profile_name, count in counts.items()}
+
+
+_worker_generator: Optional[Generator] = None
+
+
+def _setup_worker(
+        config: Config,
+        cache_path: str,
+        max_attempt_count: int,
+        materialize_threshold: int) -> None:
+    # The cache is created in the worker, so it reports to the same stats as
+    # the generator, whose counters are merged by the parent process.
+    global _worker_generator
+    stats = Stats()
+    _worker_generator = Generator(
+        config,
+        Cache(cache_path, stats),
+        max_attempt_count,
+        True,
+        stats=stats,
+        materialize_threshold=materialize_threshold,
+        save_estimates=False)
+
+
+def _generate_worker(
+        profile_name: str,
+        count: int,
+        seed: str) -> Tuple[
+            List[str], Dict[str, float], Dict[str, List[int]]]:
+    # The parent process merges the counters and the estimates, so only it
+    # writes them. A worker may return fewer code names than requested, so
+    # the count is not passed to the generator, which would fail.
+    _worker_generator.set_seed(seed)
+    code_name_list = list(itertools.islice(
+        _worker_generator.iter_generate(profile_name), count))
+    return (
+        code_name_list,
+        _worker_generator.get_stats().pop_counters(),
+        _worker_generator.pop_estimate_deltas())
@@ -0,0 +1,25 @@
+import concurrent.futures
+import threading
+from typing import Dict, Tuple
+
+
+class PageStore:
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__futures: Dict[str, concurrent.futures.Future] = {}
+
+    def reserve(self, key: str) -> Tuple[concurrent.futures.Future, bool]:
+        # The first caller gets a new future and must set its result. Other
+        # callers get the same future and only wait for it.
+        with self.__lock:
+            future = self.__futures.get(key)
+            if future is not None:
+                return future, False
+            future = concurrent.futures.Future()
+            self.__futures[key] = future
+            return future, True
+
+    def get_count(self) -> int:
+        with self.__lock:
+            return len(self.__futures)
@@ -0,0 +1,133 @@
+import sqlite3
+import threading
+from os import makedirs, path
+from typing import List
+
+
+class Registry:
+
+    FILE_NAME = 'registry.sqlite3'
+
+    class RegistryException(Exception):
+        def __init__(self, message: str, source_exception: Exception = None):
+            self.source_exception = source_exception
+            super().__init__(message)
+
+    def __init__(self, base_path: str = 'registry/', timeout: int = 60):
+        self.__base_path = base_path
+        self.__timeout = timeout
+        self.__connection = None
+        self.__lock = threading.RLock()
+
+    def __get_connection(self) -> sqlite3.Connection:
+        if not self.__connection:
+            raise Registry.RegistryException(
+                'The registry has not been set up: {}'.format(
+                    self.__base_path))
+        return self.__connection
+
+    def setup(self) -> None:
+        file_path = path.join(self.__base_path, self.FILE_NAME)
+        try:
+            makedirs(self.__base_path, exist_ok=True)
+            # The connection is in the autocommit mode, so the transactions
+            # are controlled explicitly and other processes are blocked only
+            # while a batch of code names is being registered.
+            self.__connection = sqlite3.connect(
+                file_path,
+                timeout=self.__timeout,
+                isolation_level=None,
+                check_same_thread=False)
+            self.__connection.execute('PRAGMA journal_mode=WAL')
+            self.__connection.execute(
+                'CREATE TABLE IF NOT EXISTS issued_code_names ('
+                'profile TEXT NOT NULL, '
+                'code_name TEXT NOT NULL, '
+                'PRIMARY KEY (profile, code_name)) WITHOUT ROWID')
+        except (OSError, sqlite3.Error) as e:
+            raise Registry.RegistryException(
+                'Could not open the registry: {}'.format(file_path), e)
+
+    def contains(self, profile_name: str, code_name: str) -> bool:
+        with self.__lock:
+            try:
+                cursor = self.__get_connection().execute(
+                    'SELECT 1 FROM issued_code_names '
+                    'WHERE profile = ? AND code_name = ?',
+                    (profile_name, code_name))
+                return cursor.fetchone() is not None
+            except sqlite3.Error as e:
+                raise Registry.RegistryException(
+                    'Could not read from the registry.', e)
+
+    def register(
+            self, profile_name: str, code_names: List[str]) -> List[str]:
+        with self.__lock:
+            registered_code_names: list[str] = []
+            connection = self.__get_connection()
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    for code_name in code_names:
+                        cursor = connection.execute(
+                            'INSERT OR IGNORE INTO issued_code_names '
+                            '(profile, code_name) VALUES (?, ?)',
+                            (profile_name, code_name))
+                        if cursor.rowcount == 1:
+                            registered_code_names.append(code_name)
+                    connection.execute('COMMIT')
+                except sqlite3.Error:
+                    connection.execute('ROLLBACK')
+                    raise
+            except sqlite3.Error as e:
+                raise Registry.RegistryException(
+                    'Could not write to the registry.', e)
+            return registered_code_names
+
+    def unregister(self, profile_name: str, code_names: List[str]) -> None:
+        with self.__lock:
+            connection = self.__get_connection()
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    connection.executemany(
+                        'DELETE FROM issued_code_names '
+                        'WHERE profile = ? AND code_name = ?',
+                        [(profile_name, x) for x in code_names])
+                    connection.execute('COMMIT')
+                except sqlite3.Error:
+                    connection.execute('ROLLBACK')
+                    raise
+            except sqlite3.Error as e:
+                raise Registry.RegistryException(
+                    'Could not write to the registry.', e)
+
+    def get_count(self, profile_name: str) -> int:
+        with self.__lock:
+            try:
+                cursor = self.__get_connection().execute(
+                    'SELECT COUNT(*) FROM issued_code_names WHERE profile = ?',
+                    (profile_name,))
+                return cursor.fetchone()[0]
+            except sqlite3.Error as e:
+                raise Registry.RegistryException(
+                    'Could not read from the registry.', e)
+
+    def clear(self, profile_name: str = None):
+        with self.__lock:
+            try:
+                if profile_name:
+                    self.__get_connection().execute(
+                        'DELETE FROM issued_code_names WHERE profile = ?',
+                        (profile_name,))
+                else:
+                    self.__get_connection().execute(
+                        'DELETE FROM issued_code_names')
+            except sqlite3.Error as e:
+                raise Registry.RegistryException(
+                    'Could not clear the registry.', e)
+
+    def close(self):
+        if self.__connection:
+            self.__connection.close()
+            self.__connection = None
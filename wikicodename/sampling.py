@@ -0,0 +1,54 @@
+import math
+import random
+from typing import List
+
+
+class AliasTable:
+
+    class AliasTableException(Exception):
+
+        def __init__(self, message: str, source_exception: Exception = None):
+            self.source_exception = source_exception
+            super().__init__(message)
+
+    def __init__(self, weights: List[float]):
+        # The table is built with Vose's variant of Walker's alias method, so
+        # each sample takes a constant time regardless of the number of
+        # weights.
+        count = len(weights)
+        if count == 0:
+            raise AliasTable.AliasTableException(
+                'The list of weights is empty.')
+        for weight in weights:
+            if weight < 0 or not math.isfinite(weight):
+                raise AliasTable.AliasTableException(
+                    'The weight is invalid: {}'.format(weight))
+        total_weight = math.fsum(weights)
+        if total_weight <= 0:
+            raise AliasTable.AliasTableException(
+                'The sum of the weights must be positive.')
+        probabilities = [x * count / total_weight for x in weights]
+        self.__probabilities = [1.0] * count
+        self.__aliases = list(range(count))
+        small = [i for i, x in enumerate(probabilities) if x < 1]
+        large = [i for i, x in enumerate(probabilities) if x >= 1]
+        while small and large:
+            small_index = small.pop()
+            large_index = large.pop()
+            self.__probabilities[small_index] = probabilities[small_index]
+            self.__aliases[small_index] = large_index
+            probabilities[large_index] -= 1 - probabilities[small_index]
+            if probabilities[large_index] < 1:
+                small.append(large_index)
+            else:
+                large.append(large_index)
+        # The remaining probabilities differ from one only by rounding errors.
+
+    def __len__(self) -> int:
+        return len(self.__probabilities)
+
+    def sample(self, rng: random.Random) -> int:
+        index = rng.randrange(len(self.__probabilities))
+        if rng.random() < self.__probabilities[index]:
+            return index
+        return self.__aliases[index]
@@ -0,0 +1,59 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator
+
+
+class Stats:
+
+    def __init__(self, callback: Callable[[str, float], None] = None):
+        self.__callback = callback
+        self.__lock = threading.Lock()
+        self.__counters: Dict[str, float] = {}
+
+    def __reduce__(self):
+        # The counters of other processes are merged explicitly, so a copy
+        # sent to a worker process starts empty and without the callback.
+        return (Stats, ())
+
+    def increment(self, name: str, value: float = 1) -> None:
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+        if self.__callback:
+            self.__callback(name, value)
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.increment(name, time.perf_counter() - start_time)
+
+    def merge(self, counters: Dict[str, float]) -> None:
+        for name, value in counters.items():
+            self.increment(name, value)
+
+    def get(self, name: str) -> float:
+        with self.__lock:
+            return self.__counters.get(name, 0)
+
+    def get_counters(self) -> Dict[str, float]:
+        with self.__lock:
+            return dict(self.__counters)
+
+    def pop_counters(self) -> Dict[str, float]:
+        with self.__lock:
+            counters = self.__counters
+            self.__counters = {}
+            return counters
+
+    def get_report(self) -> dict:
+        report = {}
+        for name, value in sorted(self.get_counters().items()):
+            node = report
+            keys = name.split('.', 2)
+            for key in keys[:-1]:
+                node = node.setdefault(key, {})
+            node[keys[-1]] = value
+        return report
@@ -1,15 +1,32 @@
 import concurrent.futures
 import json
-from typing import Optional, List, Tuple
+import os
+import re
+import time
+import zlib
+from typing import Callable, Iterator, NamedTuple, Optional, List, Tuple
 from lxml import etree
-from urllib.error import URLError
 from urllib.parse import urljoin, urlencode, parse_qs
-from urllib.request import urlopen
 from .cache import Cache
+from .fetch_scheduler import FetchScheduler
+from .page_store import PageStore
+from .stats import Stats
 
 
 class WikiData:
 
+    TABLE_SOURCE = 'table'
+    LIST_SOURCE = 'list'
+
+    class Value(NamedTuple):
+        text: str
+        page_id: str
+        section_index: int
+        section_title: str
+        source: str
+        source_index: int
+        header: Optional[str]
+
     class WikiDataException(Exception):
 
         def __init__(self, message: str, source_exception: Exception = None):
@@ -34,31 +51,40 @@ class WikiData:
     def __init__(
             self,
             cache: Cache = None,
-            wikipedia_url: str = 'https://en.wikipedia.org/'):
+            wikipedia_url: str = 'https://en.wikipedia.org/',
+            stats: Stats = None,
+            executor: concurrent.futures.Executor = None,
+            parse_executor: concurrent.futures.Executor = None,
+            scheduler: FetchScheduler = None,
+            refresh: bool = False,
+            max_age: int = 3600,
+            page_store: PageStore = None):
         self.__cache = cache
         self.__wikipedia_url = wikipedia_url
-        self.__timeout: int = 30
-        self.__max_worker_count: int = 8
-        self.__tables: list[etree.Element] = []
-        self.__lists: list[etree.Element] = []
+        self.__stats = stats
+        self.__executor = executor
+        self.__parse_executor = parse_executor
+        self.__own_parse_executor = None
+        self.__scheduler = scheduler
+        self.__refresh = refresh
+        self.__max_age = max_age
+        self.__page_store = page_store
+        self.__max_parse_worker_count: int = os.cpu_count() or 1
+        self.__tables: list[list[list[Optional[str]]]] = []
+        self.__lists: list[list[str]] = []
         if not self.__cache:
             self.__cache = Cache()
             self.__cache.setup()
+        if not self.__stats:
+            self.__stats = Stats()
+        if not self.__scheduler:
+            self.__scheduler = FetchScheduler(stats=self.__stats)
+
+    def __enter__(self):
+        return self
 
-    def __get_text(self, node: etree.Element) -> Optional[str]:
-        if node is None:
-            return None
-        if not node.text:
-            if len(node) > 0:
-                return self.__get_text(node[0])
-            return None
-        return node.text
-
-    def __is_sublist(self, node: etree.Element) -> bool:
-        for child_node in node:
-            if child_node.tag in ['ul', 'ol', 'dl']:
-                return True
-        return False
+    def __exit__(self, *args):
+        self.close()
 
     def __get_url(
             self,
@@ -82,14 +108,46 @@ class WikiData:
             url_params['prop'] = 'sections'
         return url_base + '?' + urlencode(url_params)
 
-    def __fetch_url(self, url: str) -> str:
+    def __get_metadata(self, headers) -> dict:
+        metadata = {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'expires': None
+        }
+        cache_control = headers.get('Cache-Control') or ''
+        max_age = re.search(r'(?:^|[ ,])max-age=(\d+)', cache_control)
+        if max_age:
+            metadata['expires'] = time.time() + int(max_age.group(1))
+        return metadata
+
+    def __fetch_url(
+            self,
+            url: str,
+            metadata: dict = None) -> Tuple[Optional[dict], dict]:
         page_id = None
         if 'page' in parse_qs(url):
             page_id = parse_qs(url)['page'][0]
+        # The cached data is revalidated with the stored validators. The
+        # 'maxage' parameter only sets the lifetime of the response, so it is
+        # not a part of the URL used as the cache key.
+        headers = {}
+        if metadata and metadata.get('etag'):
+            headers['If-None-Match'] = metadata['etag']
+        if metadata and metadata.get('last_modified'):
+            headers['If-Modified-Since'] = metadata['last_modified']
+        request_url = url + '&' + urlencode({'maxage': self.__max_age})
         try:
-            response = urlopen(url, timeout=self.__timeout)
-            data = json.loads(response.read())
-        except URLError as e:
+            self.__stats.increment('wiki_data.request_count')
+            with self.__stats.measure('wiki_data.request_time'):
+                response = self.__scheduler.fetch(request_url, headers)
+            if response.status == FetchScheduler.NOT_MODIFIED_STATUS_CODE:
+                self.__stats.increment('wiki_data.not_modified_count')
+                return None, self.__get_metadata(response.headers)
+            self.__stats.increment(
+                'wiki_data.request_bytes', len(response.data))
+            data = json.loads(response.data)
+        except (OSError, zlib.error) as e:
+            self.__stats.increment('wiki_data.request_error_count')
             raise WikiData.__FetchException(
                 'Could not fetch the URL: {}'.format(url), page_id, e)
         except json.JSONDecodeError as e:
@@ -98,51 +156,271 @@ class WikiData:
         if 'error' in data and 'info' in data['error']:
             raise WikiData.__FetchException(
                 'Wikipedia API: {}'.format(data['error']['info']), page_id)
+        return data, self.__get_metadata(response.headers)
+
+    def __fetch_cached(
+            self,
+            url: str,
+            convert: Callable[[dict], str]) -> str:
+        data = self.__cache.read(url)
+        metadata = None
+        if data:
+            if not self.__refresh:
+                return data
+            metadata = self.__cache.read_metadata(url)
+            if metadata and metadata.get('expires') and \
+                    metadata['expires'] > time.time():
+                return data
+        response_data, response_metadata = self.__fetch_url(url, metadata)
+        if response_data is None:
+            # A '304 Not Modified' response may omit the validators.
+            for key, value in metadata.items():
+                if not response_metadata.get(key):
+                    response_metadata[key] = value
+            self.__cache.write_metadata(url, response_metadata)
+            return data
+        data = convert(response_data)
+        self.__cache.write(url, data)
+        self.__cache.write_metadata(url, response_metadata)
         return data
 
     def __fetch_section_list(
             self,
             page_id: str,
             wikipedia_url: str = None) -> List[Tuple[int, str]]:
-        url = self.__get_url(page_id, None, wikipedia_url)
-        data = self.__cache.read(url)
-        if not data:
-            data = self.__fetch_url(url)
+
+        def convert(data: dict) -> str:
             if 'parse' not in data or 'sections' not in data['parse']:
                 raise WikiData.__FetchException(
                     'The response has an unexpected format.', page_id)
             data = data['parse']['sections']
             data = [(int(x['index']), x['line']) for x in data if x['index']]
             data.insert(0, (0, ''))
-            self.__cache.write(url, json.dumps(data))
-        else:
-            data = json.loads(data)
-        return data
+            return json.dumps(data)
+
+        url = self.__get_url(page_id, None, wikipedia_url)
+        if not self.__page_store:
+            return json.loads(self.__fetch_cached(url, convert))
+        future, reserved = self.__page_store.reserve(url)
+        if reserved:
+            try:
+                future.set_result(
+                    json.loads(self.__fetch_cached(url, convert)))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
 
     def __fetch_section(
             self,
             page_id: str,
             section_id: int,
             wikipedia_url: str = None) -> str:
-        url = self.__get_url(page_id, section_id, wikipedia_url)
-        data = self.__cache.read(url)
-        if not data:
-            data = self.__fetch_url(url)
+
+        def convert(data: dict) -> str:
             if 'parse' not in data or 'text' not in data['parse'] or \
                     '*' not in data['parse']['text']:
                 raise WikiData.__FetchException(
                     'The response has an unexpected format.', page_id)
-            data = data['parse']['text']['*']
-            self.__cache.write(url, data)
-        return data
+            return data['parse']['text']['*']
+
+        url = self.__get_url(page_id, section_id, wikipedia_url)
+        return self.__fetch_cached(url, convert)
+
+    def __get_parse_executor(self) -> concurrent.futures.Executor:
+        if self.__parse_executor:
+            return self.__parse_executor
+        if not self.__own_parse_executor:
+            self.__own_parse_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.__max_parse_worker_count)
+        return self.__own_parse_executor
+
+    def __process_section(
+            self,
+            section_data: Tuple[
+                List[List[List[Optional[str]]]], List[List[str]], float]):
+        tables, lists, parse_time = section_data
+        self.__tables += tables
+        self.__lists += lists
+        self.__stats.increment('wiki_data.parse_time', parse_time)
+        self.__stats.increment('wiki_data.section_count')
+
+    def __fetch_sections(
+            self,
+            executor: concurrent.futures.Executor,
+            page_id: str,
+            section_list: List[Tuple[int, str]],
+            excluded_sections: List[str],
+            wikipedia_url: str):
+        future_list = []
+        for section in section_list:
+            if section[1] in excluded_sections:
+                continue
+            future = executor.submit(
+                self.__fetch_section, page_id, section[0], wikipedia_url)
+            future_list.append(future)
+        # Each section is parsed in a worker process as soon as it has been
+        # downloaded, but the results are collected in the order of sections,
+        # so the extracted values do not depend on the download order.
+        parse_executor = self.__get_parse_executor()
+        parse_futures = {}
+        for future in concurrent.futures.as_completed(future_list):
+            parse_futures[future] = parse_executor.submit(
+                _parse_section, future.result())
+        for future in future_list:
+            self.__process_section(parse_futures[future].result())
+
+    def __submit_section(
+            self,
+            executor: concurrent.futures.Executor,
+            page_id: str,
+            section_id: int,
+            wikipedia_url: str) -> Tuple[
+                concurrent.futures.Future,
+                Optional[concurrent.futures.Future]]:
+        # The section is downloaded by the executor and then parsed by the
+        # parse executor. When the pages are shared, a section requested
+        # again gets the future of the first request instead, and no
+        # download future.
+        url = self.__get_url(page_id, section_id, wikipedia_url)
+        if self.__page_store:
+            future, reserved = self.__page_store.reserve(url)
+            if not reserved:
+                return future, None
+        else:
+            future = concurrent.futures.Future()
+        parse_executor = self.__get_parse_executor()
+
+        def parse(parse_future: concurrent.futures.Future):
+            try:
+                future.set_result(parse_future.result())
+            except Exception as e:
+                future.set_exception(e)
+
+        def fetch(fetch_future: concurrent.futures.Future):
+            # The future may be shared, so it is resolved even when the
+            # download has been cancelled.
+            if fetch_future.cancelled():
+                future.set_exception(WikiData.__FetchException(
+                    'The download has been cancelled.', page_id))
+                return
+            try:
+                parse_future = parse_executor.submit(
+                    _parse_section, fetch_future.result())
+            except Exception as e:
+                future.set_exception(e)
+                return
+            parse_future.add_done_callback(parse)
+
+        try:
+            fetch_future = executor.submit(
+                self.__fetch_section, page_id, section_id, wikipedia_url)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        fetch_future.add_done_callback(fetch)
+        return future, fetch_future
+
+    def __iter_sections(
+            self,
+            executor: concurrent.futures.Executor,
+            page_id: str,
+            section_list: List[Tuple[int, str]],
+            excluded_sections: List[str],
+            wikipedia_url: str) -> Iterator[
+                Tuple[Tuple[int, str], tuple, bool]]:
+        # Each section is yielded as soon as it has been downloaded and
+        # parsed, in no particular order. When the iteration stops early, the
+        # downloads that have not started yet are cancelled.
+        sections = {}
+        fetch_futures = {}
+        try:
+            for section in section_list:
+                if section[1] in excluded_sections:
+                    continue
+                future, fetch_future = self.__submit_section(
+                    executor, page_id, section[0], wikipedia_url)
+                sections[future] = (section, fetch_future is not None)
+                if fetch_future:
+                    fetch_futures[future] = fetch_future
+            for future in concurrent.futures.as_completed(sections):
+                section, submitted = sections[future]
+                fetch_futures.pop(future, None)
+                yield section, future.result(), submitted
+        finally:
+            for fetch_future in fetch_futures.values():
+                fetch_future.cancel()
+
+    def __iter_section_values(
+            self,
+            page_id: str,
+            sections: Iterator[Tuple[Tuple[int, str], tuple, bool]],
+            headers: List[str],
+            lists: bool) -> Iterator['WikiData.Value']:
+        for section, section_data, submitted in sections:
+            tables, section_lists, parse_time = section_data
+            if submitted:
+                self.__stats.increment('wiki_data.parse_time', parse_time)
+                self.__stats.increment('wiki_data.section_count')
+            else:
+                self.__stats.increment('wiki_data.shared_section_count')
+            for table_index, table in enumerate(tables):
+                for header, values in _get_table_values_by_headers(
+                        table, headers):
+                    for value in values:
+                        yield WikiData.Value(
+                            value,
+                            page_id,
+                            section[0],
+                            section[1],
+                            self.TABLE_SOURCE,
+                            table_index,
+                            header)
+            if not lists:
+                continue
+            for list_index, values in enumerate(section_lists):
+                for value in values:
+                    yield WikiData.Value(
+                        value,
+                        page_id,
+                        section[0],
+                        section[1],
+                        self.LIST_SOURCE,
+                        list_index,
+                        None)
 
-    def __process_section(self, data: str):
-        root = etree.HTML(data)
-        for table in root.iter('tbody'):
-            self.__tables.append(table)
-        for list_tag in ['ul', 'ol', 'dl']:
-            for list_node in root.iter(list_tag):
-                self.__lists.append(list_node)
+    def iter_values(
+            self,
+            page_id: str,
+            headers: List[str] = [],
+            lists: bool = False,
+            excluded_sections: List[str] = [],
+            wikipedia_url: str = None) -> Iterator['WikiData.Value']:
+        section_list = self.__fetch_section_list(page_id, wikipedia_url)
+        if self.__executor:
+            yield from self.__iter_section_values(
+                page_id,
+                self.__iter_sections(
+                    self.__executor,
+                    page_id,
+                    section_list,
+                    excluded_sections,
+                    wikipedia_url),
+                headers,
+                lists)
+            return
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.__scheduler.get_max_concurrency()) \
+                as executor:
+            yield from self.__iter_section_values(
+                page_id,
+                self.__iter_sections(
+                    executor,
+                    page_id,
+                    section_list,
+                    excluded_sections,
+                    wikipedia_url),
+                headers,
+                lists)
 
     def fetch(
             self,
@@ -152,18 +430,23 @@ class WikiData:
         self.__tables.clear()
         self.__lists.clear()
         section_list = self.__fetch_section_list(page_id, wikipedia_url)
+        if self.__executor:
+            self.__fetch_sections(
+                self.__executor,
+                page_id,
+                section_list,
+                excluded_sections,
+                wikipedia_url)
+            return
         with concurrent.futures.ThreadPoolExecutor(
-                max_workers=self.__max_worker_count) as executor:
-            future_list = []
-            for section in section_list:
-                if section[1] in excluded_sections:
-                    continue
-                future = executor.submit(
-                    self.__fetch_section, page_id, section[0], wikipedia_url)
-                future_list.append(future)
-            for future in concurrent.futures.as_completed(future_list):
-                data = future.result()
-                self.__process_section(data)
+                max_workers=self.__scheduler.get_max_concurrency()) \
+                as executor:
+            self.__fetch_sections(
+                executor,
+                page_id,
+                section_list,
+                excluded_sections,
+                wikipedia_url)
 
     def get_table_count(self) -> int:
         return len(self.__tables)
@@ -172,28 +455,15 @@ class WikiData:
         return len(self.__lists)
 
     def get_table_headers(self, table_index: int) -> List[str]:
-        headers: list[str] = []
-        rows = iter(self.__tables[table_index])
-        if not rows:
-            return None
-        for row in rows:
-            for cell in row:
-                text = self.__get_text(cell)
-                if text:
-                    headers.append(text.strip())
-                else:
-                    headers.append(None)
-            break
-        return headers
+        return _get_table_headers(self.__tables[table_index])
 
     def get_table_values_by_column(
             self, table_index: int, column_index: int) -> List[str]:
         values: list[str] = []
-        rows = iter(self.__tables[table_index])
-        for row in rows:
+        for row in self.__tables[table_index]:
             if column_index >= len(row):
                 continue
-            value = self.__get_text(row[column_index])
+            value = row[column_index]
             if value:
                 values.append(value)
         return values[1:]
@@ -208,18 +478,110 @@ class WikiData:
                 table_index, headers.index(header))
         elif header.strip() in headers:
             return self.get_table_values_by_column(
-                table_index, headers.index(header.stip()))
+                table_index, headers.index(header.strip()))
         return []
 
+    def get_table_values_by_headers(
+            self, table_index: int, headers: List[str]) -> List[str]:
+        return [
+            x for _, values in _get_table_values_by_headers(
+                self.__tables[table_index], headers)
+            for x in values]
+
     def get_list_values(self, list_index: int) -> List[str]:
-        values: list[str] = []
-        rows = iter(self.__lists[list_index])
-        for row in rows:
-            if row.tag not in ['li', 'dt']:
-                continue
-            if self.__is_sublist(row):
-                continue
-            value = self.__get_text(row)
-            if value:
-                values.append(value)
-        return values
+        return list(self.__lists[list_index])
+
+    def close(self):
+        if self.__own_parse_executor:
+            self.__own_parse_executor.shutdown()
+            self.__own_parse_executor = None
+
+
+def _get_table_headers(table: List[List[Optional[str]]]) -> List[str]:
+    headers: list[str] = []
+    for row in table:
+        for text in row:
+            if text:
+                headers.append(text.strip())
+            else:
+                headers.append(None)
+        break
+    return headers
+
+
+def _get_table_values_by_headers(
+        table: List[List[Optional[str]]],
+        headers: List[str]) -> List[Tuple[str, List[str]]]:
+    header_index = {}
+    for column_index, text in enumerate(_get_table_headers(table)):
+        if text is not None and text not in header_index:
+            header_index[text] = column_index
+    column_headers = []
+    column_indexes = []
+    for header in headers:
+        column_index = header_index.get(header)
+        if column_index is None:
+            column_index = header_index.get(header.strip())
+        if column_index is not None:
+            column_headers.append(header)
+            column_indexes.append(column_index)
+    if not column_indexes:
+        return []
+    column_values: list[list[str]] = [[] for _ in column_indexes]
+    for row in table:
+        row_length = len(row)
+        for values, column_index in zip(column_values, column_indexes):
+            if column_index < row_length:
+                value = row[column_index]
+                if value:
+                    values.append(value)
+    # The values are grouped by the header, like the values returned by the
+    # consecutive get_table_values_by_header() calls.
+    return [
+        (header, values[1:])
+        for header, values in zip(column_headers, column_values)]
+
+
+def _get_text(node: etree.Element) -> Optional[str]:
+    if node is None:
+        return None
+    if not node.text:
+        if len(node) > 0:
+            return _get_text(node[0])
+        return None
+    return node.text
+
+
+def _is_sublist(node: etree.Element) -> bool:
+    for child_node in node:
+        if child_node.tag in ['ul', 'ol', 'dl']:
+            return True
+    return False
+
+
+def _parse_section(
+        data: str) -> Tuple[
+            List[List[List[Optional[str]]]], List[List[str]], float]:
+    # Runs in a worker process, so only plain texts are returned instead of
+    # the lxml elements.
+    start_time = time.perf_counter()
+    root = etree.HTML(data)
+    if root is None:
+        return [], [], time.perf_counter() - start_time
+    tables = []
+    for table in root.iter('tbody'):
+        tables.append([[_get_text(cell) for cell in row] for row in table])
+    lists = []
+    for list_tag in ['ul', 'ol', 'dl']:
+        for list_node in root.iter(list_tag):
+            values: list[str] = []
+            for row in list_node:
+                if row.tag not in ['li', 'dt']:
+                    continue
+                if _is_sublist(row):
+                    continue
+                value = _get_text(row)
+                if value:
+                    values.append(value)
+            lists.append(values)
+    return tables, lists, time.perf_counter() - start_time